@@ -52,7 +52,7 @@ class SokoBasic:
 if __name__ == "__main__":
     import argparse
     import os
-    from data_loader import load_xsb_levels
+    from data_loader import LevelSet
 
     parser = argparse.ArgumentParser(prog='soko_basic',
                                      description='Check a ".mov" solution generated by sokodlex',
@@ -71,7 +71,7 @@ if __name__ == "__main__":
     print("Levelset:", levelset_fname)
     print("Level:", level_i)
 
-    levels = load_xsb_levels(levelset_fname)
+    levels = LevelSet(levelset_fname)
     level = levels[level_i-1]
     with open(args.fname) as f:
         line = next(f)
@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+
+import argparse
+import contextlib
+import csv
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+
+from data_loader import LevelSet
+from level_session import LevelSession, get_level_basename
+from metrics import metrics, maybe_profile
+
+# Headless version of the 'S' key of SokoGUI, run over a whole levelset
+# in a process pool. Deadlocks and solutions are stored into the same
+# 'var' directory structure as the GUI uses.
+
+def parse_level_list(s, num_levels):
+    if s is None: return list(range(1, num_levels+1))
+    res = []
+    for part in s.split(','):
+        if '-' in part:
+            a,b = part.split('-')
+            res.extend(range(int(a), int(b)+1))
+        else: res.append(int(part))
+    return [i for i in res if 1 <= i <= num_levels]
+
+_levels = None
+_args = None
+def _init_worker(args):
+    global _levels, _args
+    _args = args
+    _levels = LevelSet(args.levelset)
+
+def search_level(level_i, levels, args):
+    np.random.seed(args.seed + level_i)
+    session = LevelSession(
+        levels[level_i-1],
+        get_level_basename(args.levelset, level_i),
+        var_dir = args.var_dir, fw_mode = not args.dual,
+        dl_flush_every = args.flush_every, dl_fsync_every = args.fsync_every,
+        trace = args.trace, dl_debug_depth = args.debug_depth,
+        heuristic = args.heuristic, dl_compact = args.compact,
+        minimize = args.minimize, minimize_steps = args.minimize_steps,
+    )
+    if args.metrics:
+        metrics.enable()
+        metrics.reset()
+        metrics_fname = os.path.join(session.level_var_dir, "metrics.json")
+        metrics.dump_periodically(metrics_fname, args.metrics_every)
+    start_time = time.time()
+    steps = 0
+    status = 'budget'
+    # the buffered deadlocks, the trace and the metrics are saved also on an error
+    try:
+        while True:
+            if args.max_steps is not None and steps >= args.max_steps: break
+            if args.max_time is not None and time.time() - start_time >= args.max_time: break
+            if not session.search_step():
+                move_stack = session.move_stack
+                if session.was_solved: status = 'solved'
+                elif move_stack.is_on_start() and move_stack.is_locked_full():
+                    status = 'unsolvable'
+                else: status = 'stuck'
+                break
+            steps += 1
+            if args.metrics: metrics.tick()
+    finally:
+        session.close()
+        if args.metrics: metrics.dump()
+
+    res = dict(
+        level = level_i,
+        status = status,
+        steps = steps,
+        time = time.time() - start_time,
+        deadlocks = [
+            stack.deadlocks._last_full_index+1
+            for stack in reversed(session.move_stacks)
+        ],
+    )
+    if args.metrics: res['metrics'] = metrics.snapshot()
+    return res
+
+def _search_level_worker(level_i):
+    if _args.profile:
+        level_var_dir = os.path.join(_args.var_dir, get_level_basename(_args.levelset, level_i))
+        os.makedirs(level_var_dir, exist_ok = True)
+        prof_fname = os.path.join(level_var_dir, "search.prof")
+    else: prof_fname = None
+    if _args.verbose:
+        return maybe_profile(prof_fname, search_level, level_i, _levels, _args)
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            return maybe_profile(prof_fname, search_level, level_i, _levels, _args)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='batch_search',
+                                     description='Headless deadlock search over a levelset',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('levelset', type=str, help='file to load the level set (in xsb format)')
+    parser.add_argument('--levels', type=str, default = None,
+                        help='levels to search, e.g. "1-10,15", all by default')
+    parser.add_argument('--var_dir', type=str, default = 'var')
+    parser.add_argument('--processes', type=int, default = os.cpu_count(),
+                        help='processes searching the levels, ignored with --minimize')
+    parser.add_argument('--max_steps', type=int, default = None, help='search steps per level')
+    parser.add_argument('--max_time', type=float, default = 60., help='seconds per level')
+    parser.add_argument('--dual', action = 'store_true', help='search with the dual (backward) stack')
+    parser.add_argument('--seed', type=int, default = 0)
+    parser.add_argument('--heuristic', type=str, default = "storage", choices = ["storage", "hungarian"],
+                        help='move ordering, hungarian = matching lower bound of hungarian.py')
+    parser.add_argument('--flush_every', type=int, default = 64,
+                        help='flush the deadlock files after this number of blocks')
+    parser.add_argument('--fsync_every', type=int, default = None,
+                        help='sync the deadlock files to the disk after this number of blocks')
+    parser.add_argument('--compact', action = 'store_true',
+                        help='drop deadlocks generalized by new full ones from the deadlock sets')
+    parser.add_argument('--minimize', type=int, default = 0,
+                        help='processes minimizing new full deadlocks in the background (see minimizer.py), '
+                        'the levels are then searched one by one in the main process')
+    parser.add_argument('--minimize_steps', type=int, default = 1000,
+                        help='search steps verifying a minimization candidate')
+    parser.add_argument('--verbose', action = 'store_true', help='keep output of the workers')
+    parser.add_argument('--debug_depth', type=int, default = 10000,
+                        help='operations kept for bug.log, 0 = off')
+    parser.add_argument('--metrics', action = 'store_true',
+                        help='collect search metrics into metrics.json of every level')
+    parser.add_argument('--metrics_every', type=float, default = 10.,
+                        help='seconds between the dumps of the metrics')
+    parser.add_argument('--metrics_csv', type=str, default = None,
+                        help='CSV file with the metrics of all the levels')
+    parser.add_argument('--profile', action = 'store_true',
+                        help='run every level under cProfile, stats stored into search.prof')
+    parser.add_argument('--trace', action = 'store_true',
+                        help='record the deadlock operations into deadlocks.trace for replay_trace.py')
+    args = parser.parse_args()
+
+    num_levels = len(LevelSet(args.levelset))
+    level_list = parse_level_list(args.levels, num_levels)
+    if args.minimize:
+        print("Searching {} levels one by one, {} minimizer processes".format(
+            len(level_list), args.minimize))
+    else: print("Searching {} levels, {} processes".format(len(level_list), args.processes))
+
+    status_count = dict()
+    level_metrics = []
+    # the processes of a pool cannot start the minimizer pools
+    if args.minimize:
+        _init_worker(args)
+        pool = None
+        results = map(_search_level_worker, level_list)
+    else:
+        pool = multiprocessing.Pool(args.processes, initializer = _init_worker,
+                                    initargs = (args,))
+        results = pool.imap_unordered(_search_level_worker, level_list)
+    with contextlib.ExitStack() as stack:
+        if pool is not None: stack.enter_context(pool)
+        for res in results:
+            status_count[res['status']] = status_count.get(res['status'], 0) + 1
+            if 'metrics' in res: level_metrics.append((res['level'], res['metrics']))
+            print("Level {}: {}, {} steps, {:.1f}s, deadlocks {} + {} dual".format(
+                res['level'], res['status'], res['steps'], res['time'], *res['deadlocks'],
+            ))
+            sys.stdout.flush()
+
+    print(", ".join(
+        "{} {}".format(n, status)
+        for status, n in sorted(status_count.items())
+    ))
+
+    if args.metrics_csv is not None:
+        with open(args.metrics_csv, 'w', newline = '') as f:
+            writer = csv.writer(f)
+            writer.writerow(["level", "kind", "name", "value"])
+            for level_i, snapshot in sorted(level_metrics):
+                for kind in ("counters", "timers"):
+                    for name, value in snapshot[kind].items():
+                        writer.writerow([level_i, kind[:-1], name, value])
@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+from data_loader import LevelSet
+from helpers import positions_true
+from soko_state import level_to_state
+from component2d import get_component, find_path, create_jump_map, find_all_box_jumps
+from move_stack import MoveStack
+from heuristic import heurictic_to_storage
+from deadlocks import deadlocks_from_file
+
+# Timings of the core kernels on a pinned set of levels.
+# Every kernel is run over a fixed workload (positions of a seeded random walk,
+# deadlocks of a seeded search), the time per call is reported in microseconds.
+# Results are stored as JSON, --compare prints the ratios to older results.
+
+def random_walk(state, num_states, rng):
+    start = state
+    states = []
+    while len(states) < num_states:
+        actions = positions_true(state.action_mask())
+        if not actions and state is start: break
+        if not actions or rng.random() < 0.02:
+            state = start
+            continue
+        state = state.move(*actions[rng.randrange(len(actions))])
+        states.append(state)
+    return states
+
+def search_deadlocks(state, dl_fname, steps, seed):
+    np.random.seed(seed)
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            move_stack = MoveStack(state, dl_fname = dl_fname)
+            for _ in range(steps):
+                if not move_stack.search_step(heuristic = heurictic_to_storage): break
+            move_stack.close()
+    return move_stack.deadlocks.dl_set
+
+# returns {name : (function, arguments)}
+def make_kernels(level, args, tmp_dir):
+    rng = random.Random(args.seed)
+    base_state = level_to_state(level)
+    states = random_walk(base_state, args.num_states, rng)
+    clears = [state.available & ~state.sub_boxes for state in states]
+    path_targets = []
+    for state in states:
+        reachable = positions_true(state.storekeepers)
+        path_targets.append(reachable[rng.randrange(len(reachable))])
+    moves = []
+    for state in states:
+        actions = positions_true(state.action_mask())
+        moves.append(actions[rng.randrange(len(actions))] if actions else None)
+    dl_fname = os.path.join(tmp_dir, "deadlocks")
+    dl_set = search_deadlocks(base_state, dl_fname, args.search_steps, args.seed)
+    if os.path.exists(dl_fname): dl_files = [(dl_fname, base_state)]
+    else: dl_files = [] # solved before any deadlock was found
+
+    return {
+        "get_component" : (
+            lambda clear, state: get_component(clear, [state.storekeeper]),
+            list(zip(clears, states)),
+        ),
+        "find_path" : (
+            lambda clear, state, target: find_path(clear, state.storekeeper, target),
+            list(zip(clears, states, path_targets)),
+        ),
+        "create_jump_map" : (create_jump_map, [(clear,) for clear in clears]),
+        "find_all_box_jumps" : (
+            lambda clear, state: find_all_box_jumps(
+                np.array(clear), state.sub_boxes, state.storekeepers, True),
+            list(zip(clears, states)),
+        ),
+        "SokoState.action_mask" : (
+            lambda state: state.action_mask(), [(state,) for state in states],
+        ),
+        "SokoState.move" : (
+            lambda state, action: state.move(*action),
+            [(state, action) for state, action in zip(states, moves) if action is not None],
+        ),
+        "DeadlockSet.find_by_state" : (
+            dl_set.find_by_state, [(state,) for state in states],
+        ),
+        "DeadlockSet.find_for_actions" : (
+            lambda state: list(dl_set.find_for_actions(
+                state, positions_true(state.action_mask()))),
+            [(state,) for state in states],
+        ),
+        "deadlocks_from_file" : (
+            deadlocks_from_file, dl_files,
+        ),
+    }
+
+def time_kernel(f, workload, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for kernel_args in workload: f(*kernel_args)
+        times.append((time.perf_counter() - start) / len(workload))
+    return dict(
+        calls = len(workload),
+        best_us = min(times) * 1e6,
+        median_us = float(np.median(times)) * 1e6,
+    )
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd = os.path.dirname(os.path.abspath(__file__)),
+            capture_output = True, text = True, check = True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, old_results):
+    print("{:40} {:>12} {:>12} {:>8}".format("kernel", "old [us]", "new [us]", "speedup"))
+    for key, res in results.items():
+        old = old_results.get(key)
+        if old is None: continue
+        print("{:40} {:12.2f} {:12.2f} {:8.2f}".format(
+            key, old['best_us'], res['best_us'], old['best_us'] / res['best_us'],
+        ))
+
+if __name__ == "__main__":
+    from batch_search import parse_level_list
+
+    parser = argparse.ArgumentParser(prog='bench_kernels',
+                                     description='Benchmark of the core kernels',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--levelset', type=str, default = "data/Large Test Suite/XSokoban_90.xsb")
+    parser.add_argument('--levels', type=str, default = "1,2,3,5,10",
+                        help='levels to benchmark, e.g. "1-10,15", the ones missing in the levelset are skipped')
+    parser.add_argument('--seed', type=int, default = 0)
+    parser.add_argument('--num_states', type=int, default = 200,
+                        help='positions per level')
+    parser.add_argument('--search_steps', type=int, default = 300,
+                        help='search steps to generate the deadlocks')
+    parser.add_argument('--repeat', type=int, default = 5)
+    parser.add_argument('--kernels', type=str, default = None,
+                        help='comma separated subset of the kernels')
+    parser.add_argument('--output', type=str, default = None, help='JSON file for the results')
+    parser.add_argument('--compare', type=str, default = None,
+                        help='JSON file with results to compare with')
+    args = parser.parse_args()
+
+    levels = LevelSet(args.levelset)
+    level_list = parse_level_list(args.levels, len(levels))
+    results = dict()
+    for level_i in level_list:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            kernels = make_kernels(levels[level_i-1], args, tmp_dir)
+            for name, (f, workload) in kernels.items():
+                if args.kernels is not None and name not in args.kernels.split(','): continue
+                if not workload: continue
+                res = time_kernel(f, workload, args.repeat)
+                res['level'] = level_i
+                key = "{}/{}".format(name, level_i)
+                results[key] = res
+                print("{:40} {:10.2f} us  ({} calls)".format(key, res['best_us'], res['calls']))
+                sys.stdout.flush()
+
+    output = dict(
+        meta = dict(
+            commit = git_commit(),
+            python = platform.python_version(),
+            numpy = np.__version__,
+            levelset = args.levelset,
+            levels = level_list,
+            seed = args.seed,
+            num_states = args.num_states,
+            search_steps = args.search_steps,
+            repeat = args.repeat,
+        ),
+        results = results,
+    )
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent = 1)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
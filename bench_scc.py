@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+
+import argparse
+import random
+import sys
+import time
+import numpy as np
+
+from deadlocks import Deadlock, DeadlockStack
+
+# Benchmark of DeadlockStack.set_descendants on synthetic stacks of growing depth.
+# The stack goes down to the given depth, every position gets dead side branches
+# (moves into deadlocks depending on the positions above them, mostly the recent ones),
+# then the positions are resolved from the bottom back to the start, each depending
+# on its side branches and the next position. Resolving a position touches
+# the deadlocks depending on it, the time per touched deadlock should not grow
+# with the depth.
+
+# only the dependencies matter, the deadlocks are empty
+_empty_component = np.zeros([1,1], dtype = bool)
+def make_deadlock():
+    return Deadlock((), (), _empty_component)
+
+def make_full(full_index):
+    deadlock = make_deadlock()
+    deadlock.full_index = full_index
+    deadlock.descendants = dict()
+    return deadlock
+
+def bench_depth(depth, branching, num_descendants, far_prob, rng):
+    dl_stack = DeadlockStack()
+    dl_stack.debug_fname = None
+    full = [make_full(i) for i in range(8)]
+    path = []
+    side = []
+    times = []
+    touched = [] # deadlocks made full or moved to a lower stack level
+
+    def set_descendants(deadlock, descendants):
+        start = time.perf_counter()
+        _, changed, _ = dl_stack.set_descendants(deadlock, [None]*len(descendants), descendants)
+        times.append(time.perf_counter() - start)
+        touched.append(len(changed))
+
+    def random_ancestor():
+        r = rng.random()
+        if r < far_prob: return rng.choice(path)
+        if r < 2*far_prob: return rng.choice(full)
+        return path[max(0, len(path) - 1 - int(rng.expovariate(0.5)))]
+
+    for i in range(depth):
+        path.append(dl_stack.add(make_deadlock(), i))
+        children = []
+        for _ in range(branching):
+            child = dl_stack.add(make_deadlock(), i+1)
+            set_descendants(child, [random_ancestor() for _ in range(num_descendants)])
+            children.append(child)
+        side.append(children)
+    forward_calls = len(times)
+
+    for i in reversed(range(depth)):
+        descendants = list(side[i])
+        if i+1 < depth: descendants.append(path[i+1])
+        set_descendants(path[i], descendants)
+
+    backward = times[forward_calls:]
+    return dict(
+        depth = depth,
+        calls = len(times),
+        forward_us = 1e6 * sum(times[:forward_calls]) / forward_calls,
+        backward_us = 1e6 * sum(backward) / len(backward),
+        touched = sum(touched[forward_calls:]) / len(backward),
+        touched_us = 1e6 * sum(times) / sum(touched),
+        max_ms = 1e3 * max(times),
+        full = dl_stack._last_full_index+1,
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='bench_scc',
+                                     description='Benchmark of DeadlockStack.set_descendants by stack depth',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--depths', type=str, default = "250,1000,4000",
+                        help='comma separated stack depths')
+    parser.add_argument('--branching', type=int, default = 3, help='dead side branches per position')
+    parser.add_argument('--descendants', type=int, default = 3, help='descendants of a side branch')
+    parser.add_argument('--far_prob', type=float, default = 0.05,
+                        help='probability of a descendant anywhere on the stack, and of a full one')
+    parser.add_argument('--seed', type=int, default = 0)
+    args = parser.parse_args()
+
+    print("{:>7} {:>8} {:>11} {:>11} {:>9} {:>10} {:>8} {:>7}".format(
+        "depth", "calls", "forward us", "backward us", "touched", "us/touched", "max ms", "full"))
+    for depth in map(int, args.depths.split(',')):
+        res = bench_depth(depth, args.branching, args.descendants, args.far_prob,
+                          random.Random(args.seed))
+        print("{depth:7} {calls:8} {forward_us:11.1f} {backward_us:11.1f} {touched:9.1f}"
+              " {touched_us:10.2f} {max_ms:8.2f} {full:7}".format(**res))
+        sys.stdout.flush()
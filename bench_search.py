@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+from data_loader import LevelSet
+from soko_state import SokoState, level_to_state
+from move_stack import MoveStack
+from deadlocks import DeadlockSet, DeadlockStack
+from heuristic import heurictic_to_storage
+from level_session import get_level_basename
+from metrics import metrics, PhaseTimer, maybe_profile
+
+# End-to-end benchmark of MoveStack.search_step with heurictic_to_storage,
+# a fixed number of steps per level, every level in a fresh process.
+# Reports pushes and saved deadlocks per second, peak RSS and the time
+# spent in the phases of the search (exclusive, nested phases are not
+# counted in the outer ones), and the counters of metrics.py.
+
+timed_methods = [
+    (SokoState, "action_mask", "action_generation", False),
+    (SokoState, "move", "action_generation", False),
+    (DeadlockSet, "find_for_actions", "deadlock_lookup", True),
+    (DeadlockSet, "find_by_state", "deadlock_lookup", False),
+    (DeadlockSet, "find_one", "deadlock_lookup", False),
+    (DeadlockStack, "set_descendants", "scc", False),
+    (MoveStack, "_recheck_deadlocks_on_path", "recheck", False),
+]
+
+def bench_level(level_i, args):
+    np.random.seed(args.seed + level_i)
+    timer = PhaseTimer()
+    timer.instrument(timed_methods)
+    heuristic = timer.wrap(heurictic_to_storage, "heuristic")
+    metrics.enable()
+    metrics.reset()
+
+    level = LevelSet(args.levelset)[level_i-1]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dl_fname = os.path.join(tmp_dir, "deadlocks")
+        if args.deadlocks_dir is not None:
+            src = os.path.join(args.deadlocks_dir,
+                               get_level_basename(args.levelset, level_i), "deadlocks")
+            if os.path.exists(src): shutil.copy(src, dl_fname)
+        with open(os.devnull, 'w') as devnull:
+            with contextlib.redirect_stdout(devnull):
+                move_stack = MoveStack(level_to_state(level), dl_fname = dl_fname)
+                loaded = move_stack.deadlocks._last_full_index+1
+                steps = 0
+                start = time.perf_counter()
+                while steps < args.steps:
+                    if not move_stack.search_step(heuristic = heuristic): break
+                    steps += 1
+                total = time.perf_counter() - start
+                move_stack.close()
+
+    deadlocks = move_stack.deadlocks._last_full_index+1 - loaded
+    pushes = metrics.counters["search.pushes"]
+    phases = dict(timer.totals)
+    phases["other"] = total - sum(phases.values())
+    return dict(
+        level = level_i,
+        steps = steps,
+        time = total,
+        pushes = pushes,
+        pushes_per_s = pushes / total,
+        deadlocks = deadlocks,
+        deadlocks_per_s = deadlocks / total,
+        loaded_deadlocks = loaded,
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        phases = phases,
+        metrics = metrics.snapshot(),
+    )
+
+_args = None
+def _init_worker(args):
+    global _args
+    _args = args
+def _bench_level_worker(level_i):
+    if _args.profile is None: prof_fname = None
+    else: prof_fname = os.path.join(_args.profile, "search_l{}.prof".format(level_i))
+    return maybe_profile(prof_fname, bench_level, level_i, _args)
+
+phase_names = ["action_generation", "deadlock_lookup", "scc", "recheck", "heuristic", "other"]
+
+if __name__ == "__main__":
+    from batch_search import parse_level_list
+
+    parser = argparse.ArgumentParser(prog='bench_search',
+                                     description='End-to-end benchmark of the deadlock search',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--levelset', type=str, default = "data/Large Test Suite/XSokoban_90.xsb")
+    parser.add_argument('--levels', type=str, default = "1,2,3,5,10")
+    parser.add_argument('--steps', type=int, default = 1000, help='search steps per level')
+    parser.add_argument('--seed', type=int, default = 0)
+    parser.add_argument('--deadlocks_dir', type=str, default = None,
+                        help='var directory with recorded deadlocks to start from (not modified)')
+    parser.add_argument('--output', type=str, default = None, help='JSON file for the results')
+    parser.add_argument('--profile', type=str, default = None,
+                        help='directory for cProfile stats of the levels')
+    args = parser.parse_args()
+    if args.profile is not None: os.makedirs(args.profile, exist_ok = True)
+
+    level_list = parse_level_list(args.levels, len(LevelSet(args.levelset)))
+    print("{:>6} {:>6} {:>8} {:>9} {:>8} {:>8}  {}".format(
+        "level", "steps", "pushes/s", "dls/s", "rss MB", "time", " ".join(
+            "{:>8}".format(name[:8]) for name in phase_names
+        )))
+    results = []
+    with multiprocessing.Pool(1, initializer = _init_worker, initargs = (args,),
+                              maxtasksperchild = 1) as pool:
+        for res in pool.imap(_bench_level_worker, level_list):
+            results.append(res)
+            print("{:6} {:6} {:8.1f} {:9.2f} {:8.1f} {:8.2f}  {}".format(
+                res['level'], res['steps'], res['pushes_per_s'], res['deadlocks_per_s'],
+                res['peak_rss_mb'], res['time'], " ".join(
+                    "{:7.1f}%".format(100 * res['phases'].get(name, 0.) / res['time'])
+                    for name in phase_names
+                )))
+            sys.stdout.flush()
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(dict(args = vars(args), results = results), f, indent = 1)
@@ -0,0 +1,243 @@
+#!/usr/bin/python3
+
+import argparse
+import contextlib
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+from data_loader import LevelSet
+from soko_state import level_to_state, level_to_dual_state
+from hungarian import HungarianHeuristic
+from static_tables import load_static_tables
+from level_session import get_level_basename, stitch_solution, save_solution
+from solver import Solver, SearchLimit, load_deadlock_set
+
+# Bidirectional solver: the forward search (pushes from the start) and the dual
+# search (pulls from the goal) of solver.py run concurrently in two processes.
+# Every expanded position is published by its zobrist hash (boxes together
+# with the storekeeper component) into a shared hash set of its side,
+# a position expanded by both sides is a meeting point.
+# The paths to it are stitched by level_session.stitch_solution.
+
+# status of the shared search
+RUNNING, MET, FW_SOLVED, BW_SOLVED, STOPPED = range(5)
+
+# open addressing set of 64-bit hashes in shared memory,
+# written by a single process, read by any (0 marks an empty slot)
+class SharedHashSet:
+    def __init__(self, size_bits):
+        self.mask = (1 << size_bits) - 1
+        self.table = multiprocessing.Array('Q', 1 << size_bits, lock = False)
+        self.count = 0 # known only to the writer
+
+    def add(self, key):
+        if 4*self.count >= 3*(self.mask+1): return False # full, not shared anymore
+        key = key or 1
+        i = key & self.mask
+        while True:
+            slot = self.table[i]
+            if slot == key: return True
+            if slot == 0:
+                self.table[i] = key
+                self.count += 1
+                return True
+            i = (i+1) & self.mask
+
+    def __contains__(self, key):
+        key = key or 1
+        i = key & self.mask
+        while True:
+            slot = self.table[i]
+            if slot == key: return True
+            if slot == 0: return False
+            i = (i+1) & self.mask
+
+class SharedMeeting:
+    def __init__(self, size_bits):
+        self.tables = [SharedHashSet(size_bits), SharedHashSet(size_bits)] # [bw, fw]
+        self.lock = multiprocessing.Lock()
+        self.status = multiprocessing.Value('i', RUNNING, lock = False)
+        self.key = multiprocessing.Value('Q', 0, lock = False)
+        self.finished = multiprocessing.Value('i', 0, lock = False) # sides done searching
+
+    # sets the status if the search is still running, returns whether it did
+    def claim(self, status, key = 0):
+        with self.lock:
+            if self.status.value != RUNNING: return False
+            self.key.value = key
+            self.status.value = status
+            return True
+
+    # a side without a result waits, the other one can still meet
+    # a position it expanded (its hash set stays shared)
+    def finish_and_wait(self):
+        with self.lock: self.finished.value += 1
+        while self.status.value == RUNNING and self.finished.value < 2: time.sleep(0.01)
+
+def _search_side(fw_mode, level, level_var_dir, meeting, results, max_nodes, max_time):
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            state = level_to_state(level)
+            dual_state = level_to_dual_state(level)
+            if fw_mode:
+                start_state = state
+                dl_fname = os.path.join(level_var_dir, 'deadlocks')
+            else:
+                start_state = dual_state
+                dl_fname = os.path.join(level_var_dir, 'dual_deadlocks')
+            dl_set = load_deadlock_set(dl_fname, start_state)
+            heuristic = HungarianHeuristic(load_static_tables(level_var_dir, state, dual_state))
+            own, other = meeting.tables[fw_mode], meeting.tables[not fw_mode]
+
+            met = []
+            def meet(key):
+                status = meeting.status.value
+                if status == RUNNING:
+                    own.add(key)
+                    if key in other and meeting.claim(MET, key): status = MET
+                    else: status = meeting.status.value
+                if status == MET:
+                    met.append(meeting.key.value)
+                    return meeting.key.value
+                if status != RUNNING: raise SearchLimit()
+                return None
+
+            solver = Solver(start_state, dl_set, heuristic, fw_mode = fw_mode,
+                            max_nodes = max_nodes, max_time = max_time, meet = meet)
+            if dl_set.find_by_state(start_state) is not None: actions = None
+            else:
+                try: actions = solver.solve("astar")
+                except SearchLimit: actions = False
+
+            if met: kind = 'meet'
+            elif actions is None or actions is False:
+                # only the forward search proves unsolvability,
+                # the dual one starts from a single storekeeper component
+                if actions is None and fw_mode: meeting.claim(STOPPED)
+                meeting.finish_and_wait()
+                if meeting.status.value == MET and solver.parents is not None \
+                   and meeting.key.value in solver.parents:
+                    # the other side met a position expanded here
+                    actions = solver.path_to(meeting.key.value)
+                    kind = 'meet'
+                else: kind = 'unsolvable' if actions is None else 'budget'
+            else:
+                meeting.claim(FW_SOLVED if fw_mode else BW_SOLVED)
+                kind = 'solved'
+    results.put((fw_mode, kind, actions, solver.stats))
+
+def bidirectional_solve(level, level_basename, var_dir = 'var',
+                        max_nodes = None, max_time = None, table_bits = 22):
+    state = level_to_state(level)
+    dual_state = level_to_dual_state(level)
+    level_var_dir = os.path.join(var_dir, level_basename)
+    os.makedirs(level_var_dir, exist_ok = True)
+    load_static_tables(level_var_dir, state, dual_state) # computed once for both sides
+
+    start_time = time.time()
+    meeting = SharedMeeting(table_bits)
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(
+            target = _search_side,
+            args = (fw_mode, level, level_var_dir, meeting, results, max_nodes, max_time),
+        )
+        for fw_mode in (False, True)
+    ]
+    for worker in workers: worker.start()
+    side_results = [None, None]
+    while None in side_results:
+        try: fw_mode, kind, actions, stats = results.get(timeout = 1.)
+        except queue.Empty:
+            # a side died without sending its result (an exception, killed),
+            # the other one is stopped (without the lock, the dead side could hold it)
+            for fw_mode, worker in zip((False, True), workers):
+                if side_results[fw_mode] is None and worker.exitcode not in (None, 0):
+                    side_results[fw_mode] = ('error', None, dict())
+                    meeting.status.value = STOPPED
+            continue
+        side_results[fw_mode] = (kind, actions, stats)
+    for worker in workers: worker.join()
+
+    res = dict(time = time.time() - start_time)
+    for fw_mode, name in ((True, 'fw'), (False, 'bw')):
+        for stat, value in side_results[fw_mode][2].items():
+            res[name+'_'+stat] = value
+    bw_kind, bw_actions, _ = side_results[False]
+    fw_kind, fw_actions, _ = side_results[True]
+    if 'error' in (fw_kind, bw_kind):
+        res['status'] = 'error'
+        return res
+    if fw_kind == 'solved': bw_actions = []
+    elif bw_kind == 'solved': fw_actions = []
+    elif fw_kind == 'meet' and bw_kind == 'meet': pass
+    else:
+        res['status'] = 'unsolvable' if fw_kind == 'unsolvable' else 'budget'
+        return res
+
+    fw_states = [state]
+    for action in fw_actions:
+        fw_states.append(fw_states[-1].move(*action, fw_mode = True))
+    bw_states = [dual_state]
+    for action in bw_actions:
+        bw_states.append(bw_states[-1].move(*action, fw_mode = False))
+    if fw_kind == 'meet':
+        # guard against a hash collision
+        fw_state, bw_state = fw_states[-1], bw_states[-1]
+        if not ((fw_state.sub_boxes == bw_state.sub_boxes).all()
+                and fw_state.storekeepers[bw_state.storekeeper]):
+            res['status'] = 'collision'
+            return res
+
+    fw_moves, fw_actions = stitch_solution(fw_states, fw_actions, bw_states, bw_actions)
+    save_solution(level_var_dir, fw_moves, fw_actions)
+    res['status'] = 'solved'
+    res['pushes'] = len(fw_actions)
+    res['moves'] = len(fw_moves)
+    return res
+
+if __name__ == "__main__":
+    from batch_search import parse_level_list
+
+    parser = argparse.ArgumentParser(prog='bidir',
+                                     description='Bidirectional solver, forward and dual search in two processes',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('levelset', type=str, help='file to load the level set (in xsb format)')
+    parser.add_argument('--levels', type=str, default = None,
+                        help='comma separated level numbers or ranges (1-based), default all')
+    parser.add_argument('--var_dir', type=str, default = 'var')
+    parser.add_argument('--max_nodes', type=int, default = 100000,
+                        help='expanded positions per level and side')
+    parser.add_argument('--max_time', type=float, default = 60., help='seconds per level')
+    parser.add_argument('--table_bits', type=int, default = 22,
+                        help='log2 of the size of the shared hash sets')
+    args = parser.parse_args()
+
+    levels = LevelSet(args.levelset)
+    level_list = parse_level_list(args.levels, len(levels))
+    status_count = dict()
+    for level_i in level_list:
+        with open(os.devnull, 'w') as devnull:
+            with contextlib.redirect_stdout(devnull):
+                res = bidirectional_solve(
+                    levels[level_i-1], get_level_basename(args.levelset, level_i),
+                    var_dir = args.var_dir, max_nodes = args.max_nodes,
+                    max_time = args.max_time, table_bits = args.table_bits,
+                )
+        status_count[res['status']] = status_count.get(res['status'], 0) + 1
+        if res['status'] == 'solved':
+            solution = ", {} pushes, {} moves".format(res['pushes'], res['moves'])
+        else: solution = ""
+        print("Level {}: {}{}, expanded {} + {} dual, {:.1f}s".format(
+            level_i, res['status'], solution,
+            res.get('fw_expanded', '?'), res.get('bw_expanded', '?'), res['time'],
+        ))
+        sys.stdout.flush()
+
+    print(", ".join(
+        "{} {}".format(n, status)
+        for status, n in sorted(status_count.items())
+    ))
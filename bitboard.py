@@ -0,0 +1,83 @@
+import numpy as np
+
+from directions import *
+
+# Boolean masks over a (padded) grid encoded as python integers,
+# square (y,x) corresponds to the bit y*width+x.
+# BitGrid holds the shape dependent constants.
+
+class BitGrid:
+    __slots__ = ["shape", "height", "width", "size", "full", "not_first_col", "not_last_col"]
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.height, self.width = self.shape
+        self.size = self.height * self.width
+        self.full = (1 << self.size) - 1
+        first_col = np.zeros(self.shape, dtype = bool)
+        first_col[:,0] = True
+        last_col = np.zeros(self.shape, dtype = bool)
+        last_col[:,-1] = True
+        self.not_first_col = self.full & ~self.to_bits(first_col)
+        self.not_last_col = self.full & ~self.to_bits(last_col)
+
+    ### Conversions
+
+    def to_bits(self, arr):
+        data = np.packbits(arr, axis = None, bitorder = 'little')
+        return int.from_bytes(data.tobytes(), 'little')
+    def from_bits(self, bits):
+        data = np.frombuffer(bits.to_bytes((self.size+7)//8, 'little'), dtype = np.uint8)
+        arr = np.unpackbits(data, count = self.size, bitorder = 'little')
+        return arr.reshape(self.shape).astype(bool)
+
+    def pos_bit(self, pos):
+        y,x = pos
+        return 1 << int(y*self.width + x)
+    def positions_bits(self, positions):
+        res = 0
+        for y,x in positions: res |= 1 << int(y*self.width + x)
+        return res
+    def bit_positions(self, bits): # sorted as positions_true
+        res = []
+        while bits:
+            low = bits & -bits
+            res.append(divmod(low.bit_length()-1, self.width))
+            bits ^= low
+        return tuple(res)
+    def first_position(self, bits):
+        if not bits: return None
+        return divmod((bits & -bits).bit_length()-1, self.width)
+
+    ### Operations
+
+    # equivalent of dir_shift_array
+    def shift(self, d, bits):
+        if d == UP: return bits >> self.width
+        elif d == DOWN: return (bits << self.width) & self.full
+        elif d == LEFT: return (bits >> 1) & self.not_last_col
+        elif d == RIGHT: return (bits << 1) & self.not_first_col
+        else: raise Exception("unexpected direction {}".format(d))
+
+    # equivalent of get_component
+    def component(self, available, start):
+        w = self.width
+        available_l = available & self.not_last_col
+        available_r = available & self.not_first_col
+        comp = start & available
+        while True:
+            comp_n = comp | ((comp >> 1) & available_l) | ((comp << 1) & available_r) \
+                | (((comp << w) | (comp >> w)) & available)
+            if comp_n == comp: return comp
+            comp = comp_n
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+_grids = dict()
+def get_bit_grid(shape):
+    shape = tuple(shape)
+    grid = _grids.get(shape, None)
+    if grid is None:
+        grid = BitGrid(shape)
+        _grids[shape] = grid
+    return grid
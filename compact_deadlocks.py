@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+from data_loader import LevelSet
+from soko_state import level_to_state, level_to_dual_state
+from deadlocks import deadlocks_from_file, compact_deadlock_blocks, write_deadlock_blocks
+
+parser = argparse.ArgumentParser(
+    prog='compact_deadlocks',
+    description='Removes deadlocks generalized by other ones from a deadlock file, redirecting the references to them')
+parser.add_argument('--datadir', type = str, default = "data/Large Test Suite Sets/")
+parser.add_argument('--data_suffix', type = str, default = ".xsb")
+parser.add_argument('--output', type = str, default = None,
+                    help='write the compacted deadlocks there instead of rewriting fname')
+parser.add_argument('--check', action = 'store_true',
+                    help='check the descendants of every deadlock after the compaction')
+parser.add_argument('fname', type=str, help='deadlocks file_name (var_dir/deadlocks or var_dir/dual_deadlocks), path is expected to correspond to the levelset')
+
+args = parser.parse_args()
+
+level_var_dir, dl_fname = os.path.split(args.fname)
+_, level_fname = os.path.split(level_var_dir)
+i = level_fname.rindex('_l')
+level_i = int(level_fname[i+2:])
+levelset_fname = os.path.join(args.datadir, level_fname[:i]+args.data_suffix)
+
+levels = LevelSet(levelset_fname)
+level = levels[level_i-1]
+fw_mode = not dl_fname.startswith("dual")
+if fw_mode: base_state = level_to_state(level)
+else: base_state = level_to_dual_state(level)
+
+blocks = deadlocks_from_file(args.fname, base_state)
+num_deadlocks = sum(len(block) for block in blocks)
+blocks, removed = compact_deadlock_blocks(blocks)
+if args.check:
+    for block in blocks:
+        for dl in block: dl.check_dependencies(base_state, fw_mode = fw_mode)
+
+output = args.output
+if output is None: output = args.fname
+tmp_fname = output+".tmp"
+with open(tmp_fname, 'w') as f:
+    write_deadlock_blocks(f, blocks)
+os.replace(tmp_fname, output)
+# the binary sidecar of the old content is rebuilt on the next load
+if os.path.exists(output+".bin"): os.remove(output+".bin")
+print("{} of {} deadlocks removed, {} in {} blocks written to {}".format(
+    removed, num_deadlocks, num_deadlocks - removed, len(blocks), output,
+))
@@ -3,27 +3,89 @@ from collections import defaultdict, deque
 
 from directions import *
 from helpers import *
+from bitboard import get_bit_grid
 
+# flood fill by shift-and-mask dilation on a bitboard
 def get_component(available, start_positions):
-    q = deque(start_positions)
-    res = np.zeros(available.shape, dtype = bool)
-    while q:
-        pos = q.popleft()
-        if res[pos] or not available[pos]: continue
-        res[pos] = True
-        q.extend(
-            dir_shift(d, pos)
-            for d in directions
-        )
-    return res
+    grid = get_bit_grid(available.shape)
+    comp = grid.component(
+        grid.to_bits(available),
+        grid.positions_bits(start_positions),
+    )
+    return grid.from_bits(comp)
+
+# labels all the components at once, returns (labels, num_components)
+# labels are 1 ... num_components ordered by the first square, 0 outside
+def label_components(available):
+    h,w = available.shape
+    size = h*w
+    # every square points to the minimal index in its component found so far
+    labels = np.where(available.reshape(-1), np.arange(size), size)
+    labels = np.append(labels, size) # sentinel for unavailable squares
+    grid_labels = labels[:-1].reshape(h,w)
+    while True:
+        neighbors = np.array(grid_labels)
+        np.minimum(neighbors[1:], grid_labels[:-1], out = neighbors[1:])
+        np.minimum(neighbors[:-1], grid_labels[1:], out = neighbors[:-1])
+        np.minimum(neighbors[:,1:], grid_labels[:,:-1], out = neighbors[:,1:])
+        np.minimum(neighbors[:,:-1], grid_labels[:,1:], out = neighbors[:,:-1])
+        neighbors = np.where(available, neighbors, size).reshape(-1)
+        neighbors = np.minimum(neighbors, labels[neighbors]) # pointer jumping
+        if (neighbors == labels[:-1]).all(): break
+        labels[:-1] = neighbors
+    roots, res = np.unique(labels[:-1], return_inverse = True)
+    res = res.reshape(h,w) + 1
+    num_components = len(roots)
+    if roots[-1] == size:
+        res[~available] = 0
+        num_components -= 1
+    return res, num_components
 
 def component_split(component):
-    component = np.array(component)
-    while component.any():
-        pos = positions_true(component)[0]
-        subcomp = get_component(component, [pos])
+    labels, num_components = label_components(component)
+    for label in range(1, num_components+1):
+        subcomp = (labels == label)
+        pos = np.unravel_index(np.argmax(subcomp), subcomp.shape)
         yield pos, subcomp
-        component = component & ~subcomp
+
+# cyclic order of the 8 neighbors, consecutive ones are adjacent
+_ring = [(-1,0), (-1,1), (0,1), (1,1), (1,0), (1,-1), (0,-1), (-1,-1)]
+
+# checks whether removing pos cannot split the component,
+# that is, the direct neighbors of pos in the component are connected
+# through the squares around pos
+def ring_connected(component, pos):
+    y,x = pos
+    ring = [bool(component[y+dy,x+dx]) for dy,dx in _ring]
+    if all(ring): return True
+    start = ring.index(False)
+    runs = 0
+    run_has_edge = False
+    for i in range(start+1, start+9):
+        i %= 8
+        if ring[i]:
+            if i % 2 == 0: run_has_edge = True
+        else:
+            if run_has_edge: runs += 1
+            run_has_edge = False
+    return runs <= 1
+
+# updates a component after a push, that is, the square 'opened'
+# (next to the component) becomes available, and 'closed' stops being available,
+# 'available' is the new availability map
+# returns None if the component could split and it has to be recomputed
+def update_component(component, available, opened, closed):
+    res = np.array(component)
+    res[opened] = True
+    if res[closed]:
+        res[closed] = False
+        if not ring_connected(res, closed): return None
+    merged = []
+    for d in directions:
+        pos = dir_shift(d, opened)
+        if available[pos] and not res[pos]: merged.append(pos)
+    if merged: res |= get_component(available & ~res, merged)
+    return res
 
 def find_path(available, start_pos, end_pos):
     q = deque([(start_pos, 4)])
@@ -161,17 +223,26 @@ def find_box_jumps(jump_map, available, start_pos, fw_mode):
     else:
         return None
 
-def find_box_jumps_from_sk(available, boxes, box, storekeepers, fw_mode):
+# jump_map of available & ~boxes can be given (e.g. MoveStack.get_jump_map()),
+# it is updated for the lifted box and restored back
+def find_box_jumps_from_sk(available, boxes, box, storekeepers, fw_mode, jump_map = None):
     clear = available & ~boxes
-    clear[box] = True
-    jump_map = create_jump_map(clear)
+    if jump_map is None:
+        clear[box] = True
+        jump_map = create_jump_map(clear)
+        restore = False
+    else:
+        jump_map_add_avail(box, jump_map, clear)
+        restore = True
     start_pos = []
     for d in directions:
         if fw_mode: sk = dir_shift(op_dir(d), box)
         else: sk = dir_shift(d, box)
         if storekeepers[sk]: start_pos.append((box, d))
 
-    return find_box_jumps(jump_map, clear, start_pos, fw_mode)
+    res = find_box_jumps(jump_map, clear, start_pos, fw_mode)
+    if restore: jump_map_remove_avail(box, jump_map, clear)
+    return res
 
 def find_all_box_jumps(clear, boxes, storekeepers, fw_mode, jump_map = None):
 
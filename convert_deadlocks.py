@@ -0,0 +1,35 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+from data_loader import LevelSet
+from soko_state import level_to_state
+from deadlocks import load_deadlocks, DeadlockBin, write_deadlock_blocks
+
+parser = argparse.ArgumentParser(
+    prog='convert_deadlocks',
+    description='Converts between the text deadlock files and their binary sidecars (fname.bin)')
+parser.add_argument('--datadir', type = str, default = "data/Large Test Suite Sets/")
+parser.add_argument('--data_suffix', type = str, default = ".xsb")
+parser.add_argument('--to_text', type = str, default = None,
+                    help='write the deadlocks of fname.bin into a text file instead')
+parser.add_argument('fname', type=str, help='deadlocks file_name (var_dir/deadlocks), path is expected to correspond to the levelset')
+
+args = parser.parse_args()
+
+if args.to_text is not None:
+    dl_bin = DeadlockBin(args.fname+".bin")
+    with open(args.to_text, 'w') as f:
+        write_deadlock_blocks(f, dl_bin.blocks())
+    print("{} deadlocks written to {}".format(len(dl_bin), args.to_text))
+else:
+    level_var_dir, _ = os.path.split(args.fname)
+    _, level_fname = os.path.split(level_var_dir)
+    i = level_fname.rindex('_l')
+    level_i = int(level_fname[i+2:])
+    levelset_fname = os.path.join(args.datadir, level_fname[:i]+args.data_suffix)
+
+    levels = LevelSet(levelset_fname)
+    level = levels[level_i-1]
+    deadlocks = load_deadlocks(args.fname, level_to_state(level))
+    print("{} deadlocks in {}.bin".format(len(deadlocks), args.fname))
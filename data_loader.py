@@ -69,8 +69,74 @@ def decode_sokoban_level_from_lines(lines):
 def decode_sokoban_level(item):
     return decode_sokoban_level_from_lines(item.split('|'))
 
+_xsb_valid_chars = {' ', '#', '.', '$', '*', '@', '+'}
+
+# byte ranges [start, end) of the levels in an xsb file
+def index_xsb_levels(fname):
+    ranges = []
+    with open(fname, 'rb') as f:
+        pos = 0
+        level_range = None
+        for line_b in f:
+            line = line_b.decode('windows-1250').rstrip()
+            if any(c not in _xsb_valid_chars for c in line): line = ""
+            if line:
+                if level_range is None: level_range = [pos, None]
+                level_range[1] = pos + len(line_b)
+            elif level_range is not None:
+                ranges.append(level_range)
+                level_range = None
+            pos += len(line_b)
+        if level_range is not None: ranges.append(level_range)
+    return np.array(ranges, dtype = np.int64).reshape(-1, 2)
+
+# Levels of an xsb file decoded on demand, indexed from 0 as a list.
+# The byte offsets of the levels are cached in fname+".idx.npy",
+# the first row of the cache is (file size, modification time).
+class LevelSet:
+    def __init__(self, fname):
+        self.fname = fname
+        stat = os.stat(fname)
+        file_id = (stat.st_size, stat.st_mtime_ns)
+        idx_fname = fname+".idx.npy"
+        index = None
+        if os.path.exists(idx_fname):
+            try:
+                index = np.load(idx_fname, mmap_mode = 'r')
+                if tuple(index[0]) != file_id: index = None
+            except (OSError, ValueError):
+                index = None
+        if index is None:
+            index = np.concatenate([
+                np.array([file_id], dtype = np.int64),
+                index_xsb_levels(fname),
+            ])
+            try:
+                np.save(idx_fname, index)
+            except OSError:
+                pass
+        self.ranges = index[1:]
+
+    def __len__(self): return len(self.ranges)
+    def __getitem__(self, i):
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self): raise IndexError(i)
+        with open(self.fname, 'rb') as f:
+            return self._read_level(f, i)
+    def __iter__(self):
+        with open(self.fname, 'rb') as f:
+            for i in range(len(self)):
+                yield self._read_level(f, i)
+
+    def _read_level(self, f, i):
+        start, end = self.ranges[i]
+        f.seek(start)
+        data = f.read(end - start).decode('windows-1250')
+        lines = [line.rstrip() for line in data.split('\n')]
+        return decode_sokoban_level_from_lines([line for line in lines if line])
+
 def load_xsb_levels(fname):
-    valid_chars = {' ', '#', '.', '$', '*', '@', '+'}
+    valid_chars = _xsb_valid_chars
     levels = []
     with open(fname, encoding = 'windows-1250') as f:
         level_lines = []
@@ -1,14 +1,22 @@
-from collections import defaultdict
-from itertools import combinations, chain
+from collections import defaultdict, deque
+from collections.abc import Mapping
+from itertools import chain
 import sys
 import os
 import random
+import struct
+import zlib
+import io
 
 from helpers import *
 from directions import *
 from digraph import Digraph
 from soko_state import SokoState
 from component2d import get_component, component_split
+from bitboard import get_bit_grid, popcount
+from metrics import metrics, timed
+from journal import AppendJournal
+from dl_trace import TraceWriter
 
 class Deadlock:
     __slots__ = ["boxes", "not_boxes", "sk_component",
@@ -43,16 +51,6 @@ class Deadlock:
 
     ###  Deadlock checking
 
-    def check_sets(self, boxes_set, nboxes_set, storekeeper):
-        return (
-            all(box in boxes_set for box in self.boxes)
-            and self.nboxes_check_sets(boxes_set, nboxes_set)
-            and self.sk_component[storekeeper]
-        )
-    def nboxes_check_sets(self, boxes_set, nboxes_set):
-        if nboxes_set is None: return all(box not in boxes_set for box in self.not_boxes)
-        else: return all(box in nboxes_set for box in self.not_boxes)
-
     def check_state(self, state):
         if state.multi_component:
             if not (state.storekeepers <= self.sk_component).all(): return False
@@ -65,6 +63,14 @@ class Deadlock:
 
         return all(state.sub_boxes[box] for box in self.boxes)
 
+    # every state matching other matches self too
+    def generalizes(self, other):
+        return (
+            set(self.boxes).issubset(other.boxes)
+            and set(self.not_boxes).issubset(other.not_boxes)
+            and (other.sk_component <= self.sk_component).all()
+        )
+
     def check_dependencies(self, base_state, fw_mode = True):
         state = self.to_soko_state(base_state)
         assert not state.is_solved()
@@ -111,86 +117,160 @@ def deadlock_from_state(state):
     else: not_boxes = positions_true(state.available & ~state.sup_boxes)
     return Deadlock(boxes_sorted, not_boxes, state.storekeepers)
 
+# Deadlocks indexed by squares, every deadlock gets an id, and for every square
+# there are bitmasks (python integers) of the deadlocks which have a box there,
+# which have the square blocked, and whose storekeeper component contains it.
 class DeadlockSet:
     def __init__(self):
-        self.box_dl = Digraph() # box node -> deadlocks
-
-        self._boxes_to_deadlock = defaultdict(list)
-        self._box_to_size_to_nodeA = defaultdict(dict)
-        self._nbox_to_size_to_nodeA = defaultdict(dict)
-        self._last_node = -1
-
-    def _get_node(self, d, box, size):
-        node = d[box].get(size, None)
-        if node is not None: return node
-        self._last_node += 1
-        d[box][size] = self._last_node
-        self.box_dl.add_node_A(self._last_node)
-        return self._last_node
-    
+        self._deadlocks = [] # id -> deadlock, None if free or not decoded yet
+        self._ids = dict() # decoded deadlock -> id
+        self._free_ids = []
+        self._lazy = None # source of deadlocks not decoded yet
+        self._count = 0
+        self._box_bits = defaultdict(int)
+        self._nbox_bits = defaultdict(int)
+        self._sk_bits = defaultdict(int)
+        self._size_bits = defaultdict(int) # number of boxes -> deadlocks
+
+    def __len__(self): return self._count
+    def __contains__(self, deadlock): return deadlock in self._ids # decoded ones only
+    def __iter__(self):
+        free_ids = set(self._free_ids)
+        for dl_id in range(len(self._deadlocks)):
+            if dl_id not in free_ids: yield self._get(dl_id)
+
+    def _get(self, dl_id):
+        deadlock = self._deadlocks[dl_id]
+        if deadlock is None:
+            deadlock = self._lazy[dl_id]
+            self._deadlocks[dl_id] = deadlock
+            self._ids[deadlock] = dl_id
+        return deadlock
+
+    # adds all deadlocks of a DeadlockBin without decoding them,
+    # load_deadlocks returns a plain list if the .bin cannot be written
+    def load_lazy(self, source):
+        if self._deadlocks or not isinstance(source, DeadlockBin):
+            for deadlock in source: self.add(deadlock)
+            return
+        self._lazy = source
+        self._deadlocks = [None]*len(source)
+        self._count = len(source)
+        self._box_bits.update(source.square_masks("boxes"))
+        self._nbox_bits.update(source.square_masks("blocked"))
+        self._sk_bits.update(source.square_masks("sk_component"))
+        self._size_bits.update(source.size_masks())
+
     def add(self, deadlock):
         if isinstance(deadlock, SokoState):
             deadlock = deadlock_from_state(deadlock)
-        self.box_dl.add_node_B(deadlock)
-        self._boxes_to_deadlock[deadlock.boxes].append(deadlock)
-        size = len(deadlock.boxes)
-        for box in deadlock.boxes:
-            node = self._get_node(self._box_to_size_to_nodeA, box, size)
-            self.box_dl.add_edge(node, deadlock)
-        for nbox in deadlock.not_boxes:
-            node = self._get_node(self._nbox_to_size_to_nodeA, nbox, size)
-            self.box_dl.add_edge(node, deadlock)
+        if self._free_ids: dl_id = self._free_ids.pop()
+        else:
+            dl_id = len(self._deadlocks)
+            self._deadlocks.append(None)
+        self._deadlocks[dl_id] = deadlock
+        self._ids[deadlock] = dl_id
+        self._count += 1
+        bit = 1 << dl_id
+        for box in deadlock.boxes: self._box_bits[box] |= bit
+        for nbox in deadlock.not_boxes: self._nbox_bits[nbox] |= bit
+        for sk in positions_true(deadlock.sk_component): self._sk_bits[sk] |= bit
+        self._size_bits[len(deadlock.boxes)] |= bit
         return deadlock
 
     def remove(self, deadlock):
-        self._boxes_to_deadlock[deadlock.boxes].remove(deadlock)
-        self.box_dl.remove_node_B(deadlock)
-
+        dl_id = self._ids.pop(deadlock)
+        self._deadlocks[dl_id] = None
+        self._free_ids.append(dl_id)
+        self._count -= 1
+        mask = ~(1 << dl_id)
+        for box in deadlock.boxes: self._box_bits[box] &= mask
+        for nbox in deadlock.not_boxes: self._nbox_bits[nbox] &= mask
+        for sk in positions_true(deadlock.sk_component): self._sk_bits[sk] &= mask
+        self._size_bits[len(deadlock.boxes)] &= mask
+
+    def _bits_to_deadlocks(self, bits):
+        for size in sorted(self._size_bits.keys()):
+            size_bits = bits & self._size_bits[size]
+            while size_bits:
+                low = size_bits & -size_bits
+                yield self._get(low.bit_length()-1)
+                size_bits ^= low
+
+    # yields deadlocks containing at least one of new_boxes / new_nboxes,
+    # sorted by the number of boxes
     def find(self, new_boxes, new_nboxes, ori_boxes, ori_nboxes, storekeeper):
 
-        size_to_nodes = defaultdict(list)
-        def gen_size_to_node():
-            for box in new_boxes:
-                size_to_node = self._box_to_size_to_nodeA.get(box, None)
-                if size_to_node != None: yield size_to_node
-            for nbox in new_nboxes:
-                size_to_node = self._nbox_to_size_to_nodeA.get(nbox, None)
-                if size_to_node != None: yield size_to_node
-        for size_to_node in gen_size_to_node():
-            for size, nodeA in size_to_node.items():
-                size_to_nodes[size].append(nodeA)
-
-        if not size_to_nodes: return None
+        if metrics.enabled: metrics.count("find.calls")
+        candidates = 0
+        for box in new_boxes: candidates |= self._box_bits.get(box, 0)
+        for nbox in new_nboxes: candidates |= self._nbox_bits.get(nbox, 0)
+        if not candidates:
+            if metrics.enabled: metrics.count("find.no_new_square")
+            return
+        candidates &= self._sk_bits.get(storekeeper, 0)
+        if not candidates:
+            if metrics.enabled: metrics.count("find.no_storekeeper")
+            return
+        if metrics.enabled: metrics.count("find.candidates", popcount(candidates))
 
         boxes_set = set(ori_boxes)
         boxes_set.update(new_boxes)
         boxes_set.difference_update(new_nboxes)
-        boxes_sorted = sorted(boxes_set)
-        max_size = len(boxes_sorted)
-        size_to_nodes_items = sorted(
-            filter(lambda item: item[0] <= max_size,
-                   size_to_nodes.items())
-        )
-        if ori_nboxes is None: nboxes_set = None
+
+        excluded = 0
+        for box, bits in self._box_bits.items():
+            if box not in boxes_set: excluded |= bits
+        if ori_nboxes is None:
+            for box in boxes_set:
+                excluded |= self._nbox_bits.get(box, 0)
         else:
             nboxes_set = set(ori_nboxes)
             nboxes_set.update(new_nboxes)
             nboxes_set.difference_update(new_boxes)
-        
-        for size, box_nodes in size_to_nodes_items:
-            candidate_sets = [self.box_dl.neighbors_A(box_node) for box_node in box_nodes]
-            if sum(len(candidates) for candidates in candidate_sets) < size*binom(max_size, size):
-                if len(candidate_sets) == 1: candidates = candidate_sets[0]
-                else: candidates = set().union(*candidate_sets)
-                for deadlock in candidates:
-                    if deadlock.check_sets(boxes_set, nboxes_set, storekeeper):
-                        yield deadlock
-            else:
-                for subboxes in combinations(boxes_sorted, size):
-                    for deadlock in self._boxes_to_deadlock[subboxes]:
-                        if deadlock.sk_component[storekeeper] \
-                           and deadlock.nboxes_check_sets(boxes_set, nboxes_set):
-                            yield deadlock
+            for nbox, bits in self._nbox_bits.items():
+                if nbox not in nboxes_set: excluded |= bits
+        candidates &= ~excluded
+        if metrics.enabled: metrics.count("find.matches", popcount(candidates))
+
+        yield from self._bits_to_deadlocks(candidates)
+
+    # yields the other deadlocks generalizing the given one
+    # (fewer boxes and blocked squares, larger storekeeper component)
+    def find_subsuming(self, deadlock):
+        candidates = 0
+        for size, bits in self._size_bits.items():
+            if size <= len(deadlock.boxes): candidates |= bits
+        for sk in positions_true(deadlock.sk_component):
+            candidates &= self._sk_bits.get(sk, 0)
+            if not candidates: return
+        boxes_set = set(deadlock.boxes)
+        nboxes_set = set(deadlock.not_boxes)
+        excluded = 0
+        for box, bits in self._box_bits.items():
+            if box not in boxes_set: excluded |= bits
+        for nbox, bits in self._nbox_bits.items():
+            if nbox not in nboxes_set: excluded |= bits
+        candidates &= ~excluded
+        for candidate in self._bits_to_deadlocks(candidates):
+            if candidate is not deadlock: yield candidate
+
+    # yields the other deadlocks generalized by the given one
+    def find_subsumed(self, deadlock):
+        candidates = 0
+        for size, bits in self._size_bits.items():
+            if size >= len(deadlock.boxes): candidates |= bits
+        for box in deadlock.boxes:
+            candidates &= self._box_bits.get(box, 0)
+        for nbox in deadlock.not_boxes:
+            candidates &= self._nbox_bits.get(nbox, 0)
+        if not candidates: return
+        excluded = 0
+        for sk, bits in self._sk_bits.items():
+            if not deadlock.sk_component[sk]: excluded |= bits
+        candidates &= ~excluded
+        for candidate in self._bits_to_deadlocks(candidates):
+            if candidate is not deadlock: yield candidate
 
     def find_one(self, new_boxes, new_nboxes, ori_boxes, ori_nboxes, storekeeper,
                  condition = None):
@@ -198,8 +278,15 @@ class DeadlockSet:
             new_boxes, new_nboxes, ori_boxes, ori_nboxes, storekeeper)
         if condition is not None:
             deadlocks = filter(condition, deadlocks)
-        return maybe_next(deadlocks)
+        deadlock = maybe_next(deadlocks)
+        if metrics.enabled:
+            metrics.count("find_one.calls")
+            if deadlock is not None:
+                metrics.count("find_one.hits")
+                metrics.count("find_one.hit_size.{}".format(len(deadlock.boxes)))
+        return deadlock
 
+    @timed("find_by_state")
     def find_by_state(self, state, ori_state = None):
 
         sub_boxes = state.sub_boxes
@@ -265,6 +352,7 @@ class DeadlockSet:
                 yield self.find_one([box_dest], [box_src], ori_boxes, ori_nboxes, storekeeper)
 
     def find_for_actions(self, state, actions, fw_mode = True):
+        if metrics.enabled: metrics.count("find_for_actions.actions", len(actions))
         box_moves = []
         for y,x,d in actions:
             box_src = (y+1,x+1)
@@ -275,24 +363,42 @@ class DeadlockSet:
         return self.find_for_box_moves(state, box_moves)
 
 class DeadlockStack:
-    def __init__(self, dl_set = None, fname = None, sample_state = None):
+    def __init__(self, dl_set = None, fname = None, sample_state = None,
+                 flush_every = 1, fsync_every = None, trace_fname = None,
+                 debug_depth = 10000, compact = False):
         self.fname = fname
+        # drop full deadlocks generalized by new full ones from dl_set
+        # (the deadlock file stays append-only, see compact_deadlock_blocks)
+        self.compact = compact
         self.dependencies = Digraph() # deadlock -> descendants
+        # stack_index -> the deadlocks of the dependency graph with it,
+        # all of them depend on the deadlock of that stack position
+        self.stack_levels = defaultdict(set)
         if dl_set is None: dl_set = DeadlockSet()
         self.dl_set = dl_set
         self._last_full_index = -1
-
-        self.debug_data = []
+        self._loaded = () # full deadlocks loaded from fname, indexed by full_index
+        self._new_full = [] # full deadlocks made later
+        # called with every new list of full deadlocks made by set_descendants
+        self.on_full = None
+
+        # last debug_depth operations, dumped to debug_fname on an error, see debug_lines
+        if debug_depth: self.debug_data = deque(maxlen = debug_depth)
+        else: self.debug_data = None
         self.debug_fname = "bug.log"
+        if trace_fname is not None:
+            assert sample_state is not None
+            self.trace = TraceWriter(trace_fname, sample_state.available.shape)
+        else: self.trace = None
 
         if fname is not None:
             assert sample_state is not None
             if os.path.exists(fname):
                 print("loading deadlocks...")
                 try:
-                    blocks = deadlocks_from_file(fname, sample_state)
+                    loaded = load_deadlocks(fname, sample_state)
                 except:
-                    blocks = None
+                    loaded = None
                     def backup_fnames_gen():
                         base_fname = fname+"_backup"
                         yield base_fname
@@ -306,39 +412,53 @@ class DeadlockStack:
                     os.rename(fname, backup_fname)
                     print("deadlock file corrupted, renamed to '{}'".format(backup_fname))
 
-                if blocks is not None:
-                    for dl in chain.from_iterable(blocks):
-                        self.debug_data.append(
-                            "dummy_deadlocks[{}] = make_dummy_deadlock({})".format(
-                                id(dl), dl.full_index
-                            ))
-                        self.dl_set.add(dl)
-                        self._last_full_index = dl.full_index
+                if loaded is not None:
+                    if self.debug_data is not None:
+                        self.debug_data.append(("loaded", len(loaded), fname))
+                    self.dl_set.load_lazy(loaded)
+                    self._loaded = loaded
+                    self._last_full_index = len(loaded)-1
+                    if self.trace is not None: self.trace.loaded(len(loaded))
                     print("loaded {} deadlocks".format(self._last_full_index+1))
 
+            self.journal = AppendJournal(fname, flush_every = flush_every,
+                                         fsync_every = fsync_every)
+        else: self.journal = None
+
+    def close(self):
+        if self.journal is not None: self.journal.close()
+        if self.trace is not None: self.trace.close()
+
     def add(self, deadlock, stack_index):
         assert stack_index >= 0
         if isinstance(deadlock, SokoState):
             deadlock = deadlock_from_state(deadlock)
-        self.debug_data.append(
-            "dummy_deadlocks[{}] = dl_stack.add(make_dummy_deadlock(), {})".format(
-                id(deadlock), stack_index,
-            ))
+        if self.debug_data is not None:
+            self.debug_data.append(("add", id(deadlock), stack_index))
+        if self.trace is not None: self.trace.add(deadlock, stack_index)
         deadlock.stack_index = stack_index
+        self.stack_levels[stack_index].add(deadlock)
         self.dl_set.add(deadlock)
         self.dependencies.add_node_B(deadlock)
         return deadlock
 
+    def _leave_level(self, deadlock):
+        level = self.stack_levels.get(deadlock.stack_index)
+        if level is None: return
+        level.discard(deadlock)
+        if not level: del self.stack_levels[deadlock.stack_index]
+
     # supports removing multiple deadlocks at once
     # discards also deadlocks dependent on it
     def remove(self, deadlocks):
         if isinstance(deadlocks, Deadlock): deadlocks = [deadlocks]
-        self.debug_data.append(
-            "dl_stack.remove([dummy_deadlocks[i] for i in {}])".format(
-                [id(dl) for dl in deadlocks]
-            ))
+        if self.debug_data is not None:
+            self.debug_data.append(("remove", tuple(map(id, deadlocks))))
+        if self.trace is not None: self.trace.remove(deadlocks)
         dependent = self.dependencies.closure_BA(deadlocks)
+        if self.trace is not None: self.trace.forget(dependent)
         for deadlock in dependent:
+            self._leave_level(deadlock)
             self.dl_set.remove(deadlock)
             self.dependencies.remove_node_B(deadlock)
             if deadlock.descendants is not None:
@@ -346,17 +466,43 @@ class DeadlockStack:
 
     def make_full(self, deadlock):
         assert deadlock.full_index == None
+        self._leave_level(deadlock)
         deadlock.stack_index = -1
         self.dependencies.remove_node(deadlock)
+        self._number_full(deadlock)
+
+    def _number_full(self, deadlock):
         self._last_full_index += 1
         deadlock.full_index = self._last_full_index
-
+        self._new_full.append(deadlock)
+
+    def get_full(self, full_index):
+        if full_index < len(self._loaded): return self._loaded[full_index]
+        return self._new_full[full_index - len(self._loaded)]
+
+    # adds blocks of full deadlocks proven elsewhere (see minimizer.py),
+    # their descendants are full deadlocks of this stack or of the blocks
+    # before, the blocks are saved like the ones made by set_descendants
+    def add_full_blocks(self, blocks):
+        for block in blocks:
+            for deadlock in block:
+                assert deadlock.descendants is not None
+                deadlock.stack_index = -1
+                self._number_full(deadlock)
+                self.dl_set.add(deadlock)
+            if self.trace is not None: self.trace.add_full(block)
+            if self.compact: self._drop_subsumed(block)
+            self._save_block(block)
+
+    @timed("set_descendants")
     def set_descendants(self, deadlock, pushes, descendants):
-        self.debug_data.append(
-            "dl_stack.set_descendants(dummy_deadlocks[{}], [None]*{}, [dummy_deadlocks[i] for i in {}])".format(
-                  id(deadlock), len(descendants),
-                  [id(dl) for dl in descendants],
-            ))
+        if self.debug_data is not None:
+            self.debug_data.append(("set_descendants", id(deadlock), tuple(map(id, descendants)), tuple(
+                (id(desc), desc.full_index) for desc in descendants
+                if desc.full_index is not None
+            )))
+        if self.trace is not None:
+            self.trace.set_descendants(deadlock, pushes, descendants)
 
         try:
 
@@ -367,15 +513,17 @@ class DeadlockStack:
             # add to dependency graph
 
             self.dependencies.add_node_A(deadlock)
-            for descendant in descendants:
-                if descendant.stack_index >= 0:
-                    self.dependencies.add_edge(deadlock, descendant)
+            self.dependencies.add_edges(deadlock, [
+                descendant for descendant in descendants
+                if descendant.stack_index >= 0
+            ])
 
             # update stack_index where necessary
 
-            to_check = self.dependencies.closure_BA([deadlock])
+            # the deadlocks depending on the new one are exactly its stack level,
+            # the ones not moved to a lower level remain in it
             ori_stack_index = deadlock.stack_index
-            assert all(dl.stack_index == ori_stack_index for dl in to_check)
+            to_check = self.stack_levels[ori_stack_index]
 
             # find elements of to_check looking outside
             new_stack_indices = defaultdict(list)
@@ -402,6 +550,7 @@ class DeadlockStack:
                 size_of_index[i] += 1
                 to_check.remove(dl)
                 dl.stack_index = i
+                self.stack_levels[i].add(dl)
                 dfs_stack.extend(
                     (dl2, i)
                     for dl2 in self.dependencies.neighbors_B(dl)
@@ -409,145 +558,600 @@ class DeadlockStack:
 
             # mark a strongly connected component as a full deadlock
             scc = list(to_check)
+            if metrics.enabled:
+                metrics.count("set_descendants.propagated", len(to_check_l))
+                if scc:
+                    metrics.count("scc.count")
+                    metrics.count("scc.deadlocks", len(scc))
+                    metrics.count("scc.size.{}".format(len(scc)))
             if scc:
                 for dl in scc: self.make_full(dl)
+                if self.compact: self._drop_subsumed(scc)
+                self._save_block(scc)
+                if self.on_full is not None: self.on_full(scc)
 
-                if self.fname is not None:
-                    with open(self.fname, 'a') as f:
-                        print(file = f)
-                        for dl in scc: dl.print_self(file = f)
-                    if len(scc) == 1:
-                        print("Saved deadlock {}".format(scc[0].full_index))
-                    else:
-                        print("Saved deadlocks {}-{}".format(
-                            scc[0].full_index, scc[-1].full_index
-                        ))
+            if not to_check: self.stack_levels.pop(ori_stack_index, None)
 
             # output for checking on path
             to_check_l.reverse()
             return scc, scc+to_check_l, size_of_index
 
         except Exception:
-            if self.debug_fname is not None:
+            if self.debug_fname is not None and self.debug_data is not None:
                 with open(self.debug_fname, 'w') as f:
-                    for l in self.debug_data:
+                    for l in self.debug_lines():
                         print(l, file = f)
                 print("error in DeadlockStack occured, debug data stored in "+self.debug_fname)
                 self.debug_fname = None
 
             raise
 
+    def _save_block(self, block):
+        if self.journal is None: return
+        record = io.StringIO()
+        write_deadlock_blocks(record, [block])
+        self.journal.append(record.getvalue())
+        if len(block) == 1:
+            print("Saved deadlock {}".format(block[0].full_index))
+        else:
+            print("Saved deadlocks {}-{}".format(
+                block[0].full_index, block[-1].full_index
+            ))
+
+    @timed("compact")
+    def _drop_subsumed(self, new_full):
+        for deadlock in new_full:
+            if deadlock not in self.dl_set: continue # dropped already
+            if any(dl.full_index is not None for dl in self.dl_set.find_subsuming(deadlock)):
+                dropped = [deadlock]
+            else:
+                dropped = [
+                    dl for dl in self.dl_set.find_subsumed(deadlock)
+                    if dl.full_index is not None
+                ]
+            for dl in dropped: self.dl_set.remove(dl)
+            if self.trace is not None and dropped: self.trace.drop(dropped)
+            if metrics.enabled and dropped:
+                metrics.count("compact.dropped", len(dropped))
+
+    def debug_lines(self):
+        if len(self.debug_data) == self.debug_data.maxlen:
+            yield "# only the last {} operations".format(len(self.debug_data))
+        defined = set()
+        for record in self.debug_data:
+            op = record[0]
+            if op == "loaded":
+                _, num, fname = record
+                yield "# {} deadlocks loaded from {}".format(num, fname)
+            elif op == "add":
+                _, dl_id, stack_index = record
+                defined.add(dl_id)
+                yield "dummy_deadlocks[{}] = dl_stack.add(make_dummy_deadlock(), {})".format(
+                    dl_id, stack_index,
+                )
+            elif op == "remove":
+                _, dl_ids = record
+                yield "dl_stack.remove([dummy_deadlocks[i] for i in {}])".format(list(dl_ids))
+            elif op == "set_descendants":
+                _, dl_id, desc_ids, full = record
+                # full deadlocks not made by the recorded operations (loaded, added as full)
+                for desc_id, full_index in full:
+                    if desc_id in defined: continue
+                    defined.add(desc_id)
+                    yield "dummy_deadlocks[{}] = make_dummy_deadlock({})".format(desc_id, full_index)
+                yield "dl_stack.set_descendants(dummy_deadlocks[{}], [None]*{}, [dummy_deadlocks[i] for i in {}])".format(
+                    dl_id, len(desc_ids), list(desc_ids),
+                )
+
     def check_correct(self):
         for dl in self.dependencies.nodes_A():
             assert dl.stack_index == max([
                 dl2.stack_index for dl2 in dl.descendants.values()
             ], default = -1)
 
-def deadlocks_from_file(fname, base_state):
-
-    def tokenized_lines_gen(f):
-        for line in f:
-            line = line.strip()
-            if not line: continue
-            title_line = remove_prefix(line, "Deadlock")
-            if title_line is not None:
-                yield 'title', int(title_line)
-                continue
-            act_line = remove_prefix(line, "Action")
-            if act_line is not None:
-                y,x,d,arr,desc = act_line.split()
-                y = int(y)
-                x = int(x)
-                d = c_to_dir[d]
-                assert arr == '->'
-                desc = int(desc)
-                yield 'action', (y,x,d), desc
-                continue
-            else:
-                label, data_s = line.split(':')
-                if data_s.strip():
-                    data = tuple(
-                        tuple(int(x)+1 for x in pos.split())
-                        for pos in data_s.split(',')
-                    )
-                else: data = ()
-                assert all(len(pos) == 2 for pos in data)
-                yield 'std', label, data
-
-    def read_title(title_tokens):
-        label, index = title_tokens
-        assert label == 'title'
-        return index
-    def read_std(std_tokens, desired_label2):
-        label, label2, data = std_tokens
-        assert label == 'std'
-        assert label2 == desired_label2
-        return data
-    def read_action(action_tokens):
-        if action_tokens is None or action_tokens[0] != 'action': return None
-        _, action, desc = action_tokens
-        return action, desc
-
-    def deadlock_data_gen(tokenized_lines):
-        tokens = maybe_next(tokenized_lines)
+# parsing of the deadlock files, tokens with the byte offset of their end;
+# with size, the lines not finished before it are ignored,
+# read_end[0] is kept at the end of the last line read
+def _tokenized_lines_gen(f, start, size = None, read_end = None):
+    end = start
+    for line in f:
+        if size is not None and (end + len(line) > size or not line.endswith(b"\n")): return
+        end += len(line)
+        if read_end is not None: read_end[0] = end
+        line = line.decode().strip()
+        if not line: continue
+        if line == "End":
+            yield 'end', end
+            continue
+        title_line = remove_prefix(line, "Deadlock")
+        if title_line is not None:
+            yield 'title', int(title_line), end
+            continue
+        act_line = remove_prefix(line, "Action")
+        if act_line is not None:
+            y,x,d,arr,desc = act_line.split()
+            y = int(y)
+            x = int(x)
+            d = c_to_dir[d]
+            assert arr == '->'
+            desc = int(desc)
+            yield 'action', (y,x,d), desc, end
+            continue
+        else:
+            label, data_s = line.split(':')
+            if data_s.strip():
+                data = tuple(
+                    tuple(int(x)+1 for x in pos.split())
+                    for pos in data_s.split(',')
+                )
+            else: data = ()
+            assert all(len(pos) == 2 for pos in data)
+            yield 'std', label, data, end
+
+def _read_title(title_tokens):
+    label, index, _ = title_tokens
+    assert label == 'title'
+    return index
+def _read_std(std_tokens, desired_label2):
+    label, label2, data, end = std_tokens
+    assert label == 'std'
+    assert label2 == desired_label2
+    return data, end
+def _read_action(action_tokens):
+    if action_tokens is None or action_tokens[0] != 'action': return None
+    _, action, desc, end = action_tokens
+    return (action, desc), end
+
+def _deadlock_data_gen(tokenized_lines):
+    tokens = maybe_next(tokenized_lines)
+    while True:
+        if tokens is None: return
+        if tokens[0] == 'end':
+            yield tokens
+            tokens = maybe_next(tokenized_lines)
+            continue
+        index = _read_title(tokens)
+        storekeeper, _ = _read_std(next(tokenized_lines), "Storekeeper")
+        boxes, _ = _read_std(next(tokenized_lines), "Boxes")
+        blocked, end = _read_std(next(tokenized_lines), "Blocked")
+        action_data = []
         while True:
-            if tokens is None: return
-            index = read_title(tokens)
-            storekeeper = read_std(next(tokenized_lines), "Storekeeper")
-            boxes = read_std(next(tokenized_lines), "Boxes")
-            blocked = read_std(next(tokenized_lines), "Blocked")
-            action_data = []
-            while True:
-                tokens = maybe_next(tokenized_lines)
-                action = read_action(tokens)
-                if action is None: break
-                action_data.append(action)
-            yield index, storekeeper, boxes, blocked, action_data
-            if tokens is None: break
-
+            tokens = maybe_next(tokenized_lines)
+            action = _read_action(tokens)
+            if action is None: break
+            action, end = action
+            action_data.append(action)
+        yield 'deadlock', index, storekeeper, boxes, blocked, action_data, end
+
+def _deadlock_from_data(base_state, index, storekeeper, boxes, blocked):
+    available = np.array(base_state.available)
+    for box in boxes: available[box] = False
+    sk_component = get_component(available, storekeeper)
+    deadlock = Deadlock(boxes, blocked, sk_component)
+    deadlock.full_index = index
+    return deadlock
+
+# start: byte offset where to start reading,
+# prev_deadlocks: the deadlocks in the file before 'start' (descendants can refer to them)
+# Every block is expected to be followed by an "End" line (files without them
+# are accepted too). By default, an unfinished last block raises an exception,
+# with torn_tail = True, it is dropped and the pair (blocks, end) is returned,
+# where end is the byte offset where the finished blocks end. A parse error
+# counts as a torn tail only if nothing follows the line where it was found.
+# size: the file is read only up to this offset, so that a file being appended
+# by another process can be read (taken before the reading)
+def deadlocks_from_file(fname, base_state, start = 0, prev_deadlocks = (), torn_tail = False,
+                        size = None):
+    committed = [0, start] # number of finished blocks, offset of their end
     def deadlock_blocks_gen(deadlock_data):
-        max_index = 0
+        index_shift = len(prev_deadlocks)
+        def get_deadlock(i):
+            if i < index_shift: return prev_deadlocks[i]
+            else: return dl_list[i - index_shift]
+        max_index = index_shift
         dl_list = []
         cur_block = []
-        for index, storekeeper, boxes, blocked, action_data in deadlock_data:
-            assert index == len(dl_list), (index, last_index)
-
-            available = np.array(base_state.available)
-            for box in boxes: available[box] = False
-            sk_component = get_component(available, storekeeper)
-            deadlock = Deadlock(boxes, blocked, sk_component)
-            deadlock.full_index = index
-
-            dl_list.append(deadlock)
-            cur_block.append((deadlock, action_data))
-            max_cur = max((desc for _,desc in action_data), default = max_index)
-            max_index = max(max_cur, max_index)
+        num_blocks = 0
+        has_marks = False
+        unmarked = None # last block not followed by "End"
+        # also on a parse error, the last block was finished by the next deadlock
+        try:
+            for data in deadlock_data:
+                if data[0] == 'end':
+                    assert not cur_block
+                    has_marks = True
+                    unmarked = None
+                    committed[:] = [num_blocks, data[1]]
+                    continue
+                _, index, storekeeper, boxes, blocked, action_data, end = data
+                assert index == index_shift + len(dl_list), (index, index_shift + len(dl_list))
+                if unmarked is not None and not cur_block:
+                    committed[:] = unmarked
+                    unmarked = None
+
+                deadlock = _deadlock_from_data(base_state, index, storekeeper, boxes, blocked)
+                dl_list.append(deadlock)
+                cur_block.append((deadlock, action_data))
+                max_cur = max((desc for _,desc in action_data), default = max_index)
+                max_index = max(max_cur, max_index)
+                if max_index == index:
+                    max_index += 1
+                    for deadlock, action_data in cur_block:
+                        deadlock.descendants = {
+                            action : get_deadlock(i)
+                            for action, i in action_data
+                        }
+                        #deadlock.check_dependencies(base_state)
+                    yield [dl for dl,_ in cur_block]
+                    cur_block = []
+                    num_blocks += 1
+                    unmarked = [num_blocks, end]
+        finally:
+            if unmarked is not None and not has_marks: committed[:] = unmarked
+        assert not cur_block
+
+    with open(fname, 'rb') as f:
+        f.seek(start)
+        read_end = [start]
+        tokenized_lines = _tokenized_lines_gen(f, start, size, read_end)
+        deadlock_data = _deadlock_data_gen(tokenized_lines)
+        deadlock_blocks = deadlock_blocks_gen(deadlock_data)
+        out = []
+        failed = False
+        try:
+            for block in deadlock_blocks: out.append(block)
+        except Exception:
+            if not torn_tail: raise
+            failed = True
+        num_blocks, end = committed
+        if not torn_tail:
+            assert num_blocks == len(out), "unfinished block at the end of "+fname
+            return out
+        def read_rest(offset):
+            f.seek(offset)
+            if size is None: return f.read()
+            rest = f.read(max(0, size - offset))
+            return rest[:rest.rfind(b"\n")+1] # without the unfinished line
+        # data after the line with a parse error is not a torn tail
+        if failed: assert not read_rest(read_end[0]).strip(), "corrupted "+fname
+        # unfinished data after an "End" line is not a torn tail
+        rest = read_rest(end)
+        assert not any(line.strip() == b"End" for line in rest.splitlines()), "corrupted "+fname
+
+    return out[:num_blocks], end
+
+# Yields the blocks of a deadlock file one by one without keeping them,
+# the descendants are not resolved (deadlock.descendants stays unset).
+# An unfinished last block is dropped, as by deadlocks_from_file with torn_tail = True.
+def iter_deadlock_blocks(fname, base_state):
+    with open(fname, 'rb') as f:
+        deadlock_data = _deadlock_data_gen(_tokenized_lines_gen(f, 0))
+        max_index = 0
+        cur_block = []
+        finished = None # last block not followed by "End" yet
+        has_marks = False
+        while True:
+            try: data = next(deadlock_data, None)
+            except Exception: data = None # torn tail
+            if data is None:
+                if finished is not None and not has_marks: yield finished
+                return
+            if data[0] == 'end':
+                has_marks = True
+                if finished is not None: yield finished
+                finished = None
+                continue
+            if finished is not None:
+                yield finished
+                finished = None
+            _, index, storekeeper, boxes, blocked, action_data, _ = data
+            cur_block.append(_deadlock_from_data(base_state, index, storekeeper, boxes, blocked))
+            max_index = max(max((desc for _,desc in action_data), default = max_index), max_index)
             if max_index == index:
                 max_index += 1
-                for deadlock, action_data in cur_block:
-                    deadlock.descendants = {
-                        action : dl_list[i]
-                        for action, i in action_data
-                    }
-                    #deadlock.check_dependencies(base_state)
-                yield [dl for dl,_ in cur_block]
+                finished = cur_block
                 cur_block = []
-        assert not cur_block
 
-    with open(fname) as f:
-        tokenized_lines = tokenized_lines_gen(f)
-        deadlock_data = deadlock_data_gen(tokenized_lines)
-        deadlock_blocks = deadlock_blocks_gen(deadlock_data)
-        out = list(deadlock_blocks)
-
-    return out
-        #for index, storekeeper, boxes, blocked, action_data in deadlock_data:
-        #    print("Deadlock", index)
-        #    print("  Storekeeper:", boxes)
-        #    print("  Boxes:", boxes)
-        #    print("  Blocked:", blocked)
-        #    for action in action_data:
-        #        print("  Action", action)
+# Removes the full deadlocks generalized by other ones, the descendants
+# are redirected to the generalizing deadlocks (a state matching the old one
+# matches the new one too). Of equal deadlocks, the first one is kept.
+# The rest is renumbered and split into blocks again (strongly connected
+# components, every block refers only to itself and to the blocks before it),
+# so it still forms a proof for deadlocks_to_lean.py.
+# Returns (blocks, number of removed deadlocks).
+def compact_deadlock_blocks(blocks):
+    deadlocks = list(chain.from_iterable(blocks))
+    dl_set = DeadlockSet()
+    redirect = dict()
+    for deadlock in deadlocks:
+        subsuming = maybe_next(dl_set.find_subsuming(deadlock))
+        if subsuming is not None:
+            redirect[deadlock] = subsuming
+            continue
+        for dl in list(dl_set.find_subsumed(deadlock)):
+            dl_set.remove(dl)
+            redirect[dl] = deadlock
+        dl_set.add(deadlock)
+
+    def resolve(deadlock):
+        while deadlock in redirect: deadlock = redirect[deadlock]
+        return deadlock
+    kept = [deadlock for deadlock in deadlocks if deadlock not in redirect]
+    for deadlock in kept:
+        deadlock.descendants = {
+            action : resolve(desc)
+            for action, desc in deadlock.descendants.items()
+        }
+
+    # Tarjan's algorithm, emits the components after the ones they refer to
+    index = dict()
+    lowlink = dict()
+    on_stack = set()
+    stack = []
+    out = []
+    for root in kept:
+        if root in index: continue
+        dfs_stack = [(root, iter(root.descendants.values()))]
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while dfs_stack:
+            deadlock, descendants = dfs_stack[-1]
+            desc = next(descendants, None)
+            if desc is not None:
+                if desc not in index:
+                    index[desc] = lowlink[desc] = len(index)
+                    stack.append(desc)
+                    on_stack.add(desc)
+                    dfs_stack.append((desc, iter(desc.descendants.values())))
+                elif desc in on_stack:
+                    lowlink[deadlock] = min(lowlink[deadlock], index[desc])
+                continue
+            dfs_stack.pop()
+            if dfs_stack:
+                parent = dfs_stack[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[deadlock])
+            if lowlink[deadlock] == index[deadlock]:
+                block = []
+                while True:
+                    dl = stack.pop()
+                    on_stack.remove(dl)
+                    block.append(dl)
+                    if dl is deadlock: break
+                block.sort(key = lambda dl: dl.full_index)
+                out.append(block)
+
+    for i, deadlock in enumerate(chain.from_iterable(out)):
+        deadlock.full_index = i
+    return out, len(redirect)
+
+def write_deadlock_blocks(f, blocks):
+    for block in blocks:
+        print(file = f)
+        for dl in block: dl.print_self(file = f)
+        print("End", file = f)
+
+### Binary format
+#
+# A sidecar file fname+".bin" of a text deadlock file, the text file stays
+# the canonical version. It stores the boxes, blocked squares
+# and storekeeper components as bitsets over the padded grid (see bitboard.BitGrid),
+# the descendant edges, and the ends of blocks. The file is memory-mapped
+# and the deadlocks are decoded on first use.
+# It also remembers the size of the text file prefix it covers,
+# so that deadlocks appended later can be parsed separately.
+
+_bin_magic = b'SDLX'
+_bin_version = 1
+# magic, version, height, width, count, num_edges, text_size, text_crc
+_bin_header = struct.Struct("<4sIIIIIQI")
+
+def _bin_layout(count, num_edges, nbytes):
+    return [
+        ("boxes", np.uint8, (count, nbytes)),
+        ("blocked", np.uint8, (count, nbytes)),
+        ("sk_component", np.uint8, (count, nbytes)),
+        ("block_end", np.uint8, (count,)),
+        ("desc_offsets", np.int64, (count+1,)),
+        ("desc_actions", np.int16, (num_edges, 3)),
+        ("desc_targets", np.int32, (num_edges,)),
+    ]
+def _align8(n): return (n+7) // 8 * 8
+
+# checksum of the end of the text prefix, to detect a rewritten text file
+def text_file_crc(fname, text_size):
+    start = max(0, text_size - 4096)
+    with open(fname, 'rb') as f:
+        f.seek(start)
+        return zlib.crc32(f.read(text_size - start))
+
+def deadlocks_to_arrays(blocks, shape):
+    grid = get_bit_grid(shape)
+    nbytes = (grid.size+7)//8
+    dls = list(chain.from_iterable(blocks))
+    count = len(dls)
+    num_edges = sum(len(dl.descendants) for dl in dls)
+    res = {
+        name : np.zeros(arr_shape, dtype = dtype)
+        for name, dtype, arr_shape in _bin_layout(count, num_edges, nbytes)
+    }
+    def to_bytes(positions):
+        bits = grid.positions_bits(positions)
+        return np.frombuffer(bits.to_bytes(nbytes, 'little'), dtype = np.uint8)
+    edge_i = 0
+    for i, dl in enumerate(dls):
+        res["boxes"][i] = to_bytes(dl.boxes)
+        res["blocked"][i] = to_bytes(dl.not_boxes)
+        res["sk_component"][i] = np.packbits(dl.sk_component, axis = None, bitorder = 'little')
+        for action, desc in dl.descendants.items():
+            res["desc_actions"][edge_i] = action
+            res["desc_targets"][edge_i] = desc.full_index
+            edge_i += 1
+        res["desc_offsets"][i+1] = edge_i
+    i = -1
+    for block in blocks:
+        i += len(block)
+        res["block_end"][i] = 1
+    return res
+
+def concat_deadlock_arrays(arrays1, arrays2):
+    res = dict()
+    for name in arrays1.keys():
+        arr1 = arrays1[name]
+        arr2 = arrays2[name]
+        if name == "desc_offsets": arr2 = arr2[1:] + arr1[-1]
+        res[name] = np.concatenate([arr1, arr2])
+    return res
+
+def write_deadlocks_bin(fname, arrays, shape, text_size, text_crc):
+    h,w = shape
+    count, nbytes = arrays["boxes"].shape
+    num_edges = len(arrays["desc_targets"])
+    tmp_fname = fname+".tmp"
+    with open(tmp_fname, 'wb') as f:
+        header = _bin_header.pack(
+            _bin_magic, _bin_version, h, w, count, num_edges, text_size, text_crc
+        )
+        f.write(header)
+        f.write(bytes(_align8(len(header)) - len(header)))
+        for name, dtype, arr_shape in _bin_layout(count, num_edges, nbytes):
+            data = np.ascontiguousarray(arrays[name], dtype = dtype).tobytes()
+            f.write(data)
+            f.write(bytes(_align8(len(data)) - len(data)))
+    os.replace(tmp_fname, fname)
+
+# read-only sequence of full deadlocks indexed by full_index
+class DeadlockBin:
+    def __init__(self, fname):
+        data = np.memmap(fname, dtype = np.uint8, mode = 'r')
+        magic, version, h, w, count, num_edges, text_size, text_crc = \
+            _bin_header.unpack(data[:_bin_header.size].tobytes())
+        assert magic == _bin_magic and version == _bin_version
+        self.shape = (h,w)
+        self.grid = get_bit_grid(self.shape)
+        self.text_size = text_size
+        self.text_crc = text_crc
+        self.arrays = dict()
+        offset = _align8(_bin_header.size)
+        nbytes = (self.grid.size+7)//8
+        for name, dtype, arr_shape in _bin_layout(count, num_edges, nbytes):
+            size = int(np.prod(arr_shape)) * np.dtype(dtype).itemsize
+            assert offset + size <= len(data)
+            self.arrays[name] = data[offset:offset+size].view(dtype).reshape(arr_shape)
+            offset += _align8(size)
+        self._cache = [None]*count
+
+    def __len__(self): return len(self._cache)
+    def __getitem__(self, i):
+        dl = self._cache[i]
+        if dl is not None: return dl
+        grid = self.grid
+        def positions(name):
+            bits = int.from_bytes(self.arrays[name][i].tobytes(), 'little')
+            return grid.bit_positions(bits)
+        sk_component = np.unpackbits(
+            self.arrays["sk_component"][i], count = grid.size, bitorder = 'little',
+        ).reshape(self.shape).astype(bool)
+        dl = Deadlock(positions("boxes"), positions("blocked"), sk_component)
+        dl.full_index = i
+        dl.descendants = LazyDescendants(self, i)
+        self._cache[i] = dl
+        return dl
+    def __iter__(self):
+        for i in range(len(self)): yield self[i]
+
+    def blocks(self):
+        block = []
+        for i, end in enumerate(self.arrays["block_end"]):
+            block.append(self[i])
+            if end:
+                yield block
+                block = []
+
+    # for every square, the bitmask of deadlocks (indexed by full_index) having it set
+    def square_masks(self, name):
+        grid = self.grid
+        squares = np.unpackbits(self.arrays[name], axis = 1, count = grid.size,
+                                bitorder = 'little')
+        used = np.flatnonzero(squares.any(axis = 0))
+        packed = np.packbits(squares[:,used], axis = 0, bitorder = 'little')
+        return {
+            divmod(int(sq), grid.width) : int.from_bytes(packed[:,j].tobytes(), 'little')
+            for j, sq in enumerate(used)
+        }
+    # for every number of boxes, the bitmask of deadlocks with it
+    def size_masks(self):
+        squares = np.unpackbits(self.arrays["boxes"], axis = 1, count = self.grid.size,
+                                bitorder = 'little')
+        sizes = squares.sum(axis = 1)
+        return {
+            int(size) : int.from_bytes(
+                np.packbits(sizes == size, bitorder = 'little').tobytes(), 'little'
+            )
+            for size in np.unique(sizes)
+        }
+
+class LazyDescendants(Mapping):
+    __slots__ = ["source", "index"]
+    def __init__(self, source, index):
+        self.source = source
+        self.index = index
+    def _edges(self):
+        arrays = self.source.arrays
+        start, end = arrays["desc_offsets"][self.index:self.index+2]
+        actions = map(tuple, arrays["desc_actions"][start:end].tolist())
+        return zip(actions, arrays["desc_targets"][start:end].tolist())
+    def __getitem__(self, action):
+        action = tuple(action)
+        for action2, target in self._edges():
+            if action2 == action: return self.source[target]
+        raise KeyError(action)
+    def __iter__(self):
+        for action, _ in self._edges(): yield action
+    def __len__(self):
+        start, end = self.source.arrays["desc_offsets"][self.index:self.index+2]
+        return int(end - start)
+    def items(self):
+        return [(action, self.source[target]) for action, target in self._edges()]
+
+# Loads a text deadlock file through its binary sidecar,
+# the sidecar is created or extended when it does not cover the text file.
+# An unfinished block at the end of the text file is truncated.
+# Returns a sequence of full deadlocks indexed by full_index.
+def load_deadlocks(fname, base_state):
+    bin_fname = fname+".bin"
+    shape = base_state.available.shape
+    text_size = os.path.getsize(fname)
+    source = None
+    if os.path.exists(bin_fname):
+        try:
+            source = DeadlockBin(bin_fname)
+            if source.shape != shape or source.text_size > text_size \
+               or text_file_crc(fname, source.text_size) != source.text_crc:
+                source = None
+        except Exception:
+            source = None
+    if source is not None and source.text_size == text_size: return source
+
+    if source is None:
+        blocks, end = deadlocks_from_file(fname, base_state, torn_tail = True)
+        arrays = deadlocks_to_arrays(blocks, shape)
+        prev_deadlocks = []
+    else:
+        blocks, end = deadlocks_from_file(fname, base_state, start = source.text_size,
+                                          prev_deadlocks = source, torn_tail = True)
+        arrays = concat_deadlock_arrays(source.arrays, deadlocks_to_arrays(blocks, shape))
+        prev_deadlocks = source
+    if end < text_size:
+        os.truncate(fname, end)
+        print("torn tail of '{}' truncated ({} bytes)".format(fname, text_size - end))
+        text_size = end
+    try:
+        write_deadlocks_bin(bin_fname, arrays, shape,
+                            text_size, text_file_crc(fname, text_size))
+    except OSError:
+        return list(chain(prev_deadlocks, chain.from_iterable(blocks)))
+    return DeadlockBin(bin_fname)
 
 if __name__ == "__main__":
     deadlocks_from_file("var/XSokoban_90_l26/deadlocks")
@@ -4,7 +4,7 @@
 
 import argparse
 import os
-from data_loader import load_xsb_levels, encode_sokoban_level_to_lines
+from data_loader import LevelSet, encode_sokoban_level_to_lines
 from directions import *
 from soko_state import level_to_state
 from deadlocks import deadlocks_from_file
@@ -24,7 +24,7 @@ i = level_fname.rindex('_l')
 level_i = int(level_fname[i+2:])
 levelset_fname = os.path.join(args.datadir, level_fname[:i]+args.data_suffix)
 
-levels = load_xsb_levels(levelset_fname)
+levels = LevelSet(levelset_fname)
 level = levels[level_i-1]
 
 print("-- Deadlocks:", args.fname)
@@ -100,9 +100,10 @@ def print_dl_analysis(dl, fst_block_index, indent = "  "):
             action_comment,
         ))
 
-dl_blocks = deadlocks_from_file(
-    args.fname, level_to_state(level), check_dependencies = True
-)
+base_state = level_to_state(level)
+dl_blocks = deadlocks_from_file(args.fname, base_state)
+for block in dl_blocks:
+    for dl in block: dl.check_dependencies(base_state)
 for block in dl_blocks:
     if len(block) == 1:
         [dl] = block
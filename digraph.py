@@ -1,45 +1,131 @@
+import numpy as np
+from itertools import chain
+
+# Bipartite-style digraph: a node can be an A node (with outgoing edges),
+# a B node (with incoming edges), or both.
+# Nodes are arbitrary hashable objects mapped to integer ids (reused after
+# removal), the adjacency of every id is a plain list of ids
+# (None if the node does not have the role). The lists share the int
+# objects of the ids. Every list has a parallel list of the positions
+# of the edges in the lists of the other direction, so an edge is removed
+# in O(1) by moving the last edge of the list into its place.
+
 class Digraph:
+    # closures reaching more nodes continue by frontiers over all the edges in numpy
+    # if the CSR form of the edges is up to date or cheap to rebuild
+    vectorize_above = 2048
+
     def __init__(self):
-        self._neighbors_A_d = dict()
-        self._neighbors_B_d = dict()
+        self._ids = dict() # node -> id
+        self._nodes = [] # id -> node, None if free
+        self._free_ids = []
+        self._out = [] # id -> list of B ids, None if not an A node
+        self._in = [] # id -> list of A ids, None if not a B node
+        self._out_pos = [] # id -> positions of the id in the _in lists of _out
+        self._in_pos = [] # id -> positions of the id in the _out lists of _in
+        self._num_edges = 0
+        self._version = 0 # changed on every modification of the nodes or edges
+        self._csr = [None, None] # [backward, forward] (version, degrees, indptr, indices)
 
     def nodes_A(self):
-        return self._neighbors_A_d.keys()
+        return [node for node, out in zip(self._nodes, self._out) if out is not None]
     def nodes_B(self):
-        return self._neighbors_B_d.keys()
+        return [node for node, inc in zip(self._nodes, self._in) if inc is not None]
+
+    def _get_id(self, node):
+        i = self._ids.get(node)
+        if i is not None: return i
+        if self._free_ids:
+            i = self._free_ids.pop()
+            self._nodes[i] = node
+        else:
+            i = len(self._nodes)
+            self._nodes.append(node)
+            self._out.append(None)
+            self._in.append(None)
+            self._out_pos.append(None)
+            self._in_pos.append(None)
+        self._ids[node] = i
+        return i
+    def _release_id(self, i):
+        if self._out[i] is not None or self._in[i] is not None: return
+        del self._ids[self._nodes[i]]
+        self._nodes[i] = None
+        self._free_ids.append(i)
 
     def add_node_A(self, A):
-        assert A not in self._neighbors_A_d
-        self._neighbors_A_d[A] = set()
-        #self.check_correct()
+        i = self._get_id(A)
+        assert self._out[i] is None
+        self._out[i] = []
+        self._out_pos[i] = []
+        self._version += 1
     def add_node_B(self, B):
-        assert B not in self._neighbors_B_d
-        self._neighbors_B_d[B] = set()
-        #self.check_correct()
+        i = self._get_id(B)
+        assert self._in[i] is None
+        self._in[i] = []
+        self._in_pos[i] = []
+        self._version += 1
     def add_node(self, node):
         self.add_node_A(node)
         self.add_node_B(node)
 
+    # edges from A to all of Bs, the ones already present are skipped
+    def add_edges(self, A, Bs):
+        a = self._ids[A]
+        out, out_pos = self._out[a], self._out_pos[a]
+        present = set(out)
+        for B in Bs:
+            b = self._ids[B]
+            if b in present: continue
+            present.add(b)
+            inc = self._in[b]
+            out_pos.append(len(inc))
+            self._in_pos[b].append(len(out))
+            out.append(b)
+            inc.append(a)
+            self._num_edges += 1
+        self._version += 1
     def add_edge(self, A, B):
-        self._neighbors_A_d[A].add(B)
-        self._neighbors_B_d[B].add(A)
-        #self.check_correct()
+        self.add_edges(A, (B,))
 
     def neighbors_A(self, A):
-        return self._neighbors_A_d[A]
+        nodes = self._nodes
+        return [nodes[b] for b in self._out[self._ids[A]]]
     def neighbors_B(self, B):
-        return self._neighbors_B_d[B]
+        nodes = self._nodes
+        return [nodes[a] for a in self._in[self._ids[B]]]
+
+    # removes the edge at position p of the list (and positions) of node i
+    # by moving the last edge there, the moved edge is updated on the other side
+    @staticmethod
+    def _pop_edge(lists, positions, other_positions, i, p):
+        ids, pos = lists[i], positions[i]
+        last, last_pos = ids.pop(), pos.pop()
+        if p < len(ids):
+            ids[p] = last
+            pos[p] = last_pos
+            other_positions[last][last_pos] = p
 
     def remove_node_A(self, A):
-        for B in self._neighbors_A_d[A]:
-            self._neighbors_B_d[B].remove(A)
-        del self._neighbors_A_d[A]
-        #self.check_correct()
+        a = self._ids[A]
+        out, out_pos = self._out[a], self._out_pos[a]
+        for b, p in zip(out, out_pos):
+            self._pop_edge(self._in, self._in_pos, self._out_pos, b, p)
+        self._num_edges -= len(out)
+        self._version += 1
+        self._out[a] = None
+        self._out_pos[a] = None
+        self._release_id(a)
     def remove_node_B(self, B):
-        for A in self._neighbors_B_d[B]:
-            self._neighbors_A_d[A].remove(B)
-        del self._neighbors_B_d[B]
-        #self.check_correct()
+        b = self._ids[B]
+        inc, in_pos = self._in[b], self._in_pos[b]
+        for a, p in zip(inc, in_pos):
+            self._pop_edge(self._out, self._out_pos, self._in_pos, a, p)
+        self._num_edges -= len(inc)
+        self._version += 1
+        self._in[b] = None
+        self._in_pos[b] = None
+        self._release_id(b)
     def remove_node(self, node):
         self.remove_node_A(node)
         self.remove_node_B(node)
@@ -54,24 +140,92 @@ class Digraph:
             stack.extend(get_neighbors(x))
         return res
 
-    def closure_AB(self, start_list):
-        return self.closure(
-            start_list,
-            lambda A: self._neighbors_A_d.get(A, []),
+    # ids reachable from start_ids along the edges (backwards if not forward)
+    def _closure_ids(self, start_ids, forward):
+        adjacency = self._out if forward else self._in
+        stack = list(start_ids)
+        res = set()
+        while stack:
+            x = stack.pop()
+            if x in res: continue
+            res.add(x)
+            if len(res) > self.vectorize_above and (
+                    self._version == (self._csr[forward] or (None,))[0]
+                    or self._num_edges <= 16*len(res)):
+                return self._closure_ids_vec(res.union(stack), forward)
+            neighbors = adjacency[x]
+            if neighbors is not None: stack.extend(neighbors)
+        return res
+
+    def _get_csr(self, forward):
+        csr = self._csr[forward]
+        if csr is not None and csr[0] == self._version: return csr[1:]
+        adjacency = self._out if forward else self._in
+        n = len(adjacency)
+        degrees = np.fromiter(
+            (0 if neighbors is None else len(neighbors) for neighbors in adjacency),
+            dtype = np.int64, count = n,
         )
-    def closure_BA(self, start_list):
-        return self.closure(
-            start_list,
-            lambda B: self._neighbors_B_d.get(B, [])
+        indptr = np.zeros(n+1, dtype = np.int64)
+        np.cumsum(degrees, out = indptr[1:])
+        indices = np.fromiter(
+            chain.from_iterable(neighbors for neighbors in adjacency if neighbors),
+            dtype = np.int64, count = int(indptr[-1]),
         )
+        self._csr[forward] = (self._version, degrees, indptr, indices)
+        return degrees, indptr, indices
+
+    # breadth-first by whole frontiers over the edges in CSR form
+    def _closure_ids_vec(self, start_ids, forward):
+        degrees, indptr, indices = self._get_csr(forward)
+        n = len(degrees)
+        visited = np.zeros(n, dtype = bool)
+        frontier = np.fromiter(start_ids, dtype = np.int64)
+        visited[frontier] = True
+        while len(frontier):
+            starts = indptr[frontier]
+            counts = degrees[frontier]
+            offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+            reached = indices[offsets + np.arange(len(offsets))]
+            frontier = np.unique(reached[~visited[reached]])
+            visited[frontier] = True
+        return set(np.flatnonzero(visited).tolist())
+
+    # the start nodes are always included, also if they are not in the graph
+    def _closure_nodes(self, start_list, forward):
+        nodes = self._nodes
+        res = set()
+        start_ids = []
+        for node in start_list:
+            i = self._ids.get(node)
+            if i is None: res.add(node)
+            else: start_ids.append(i)
+        res.update(nodes[i] for i in self._closure_ids(start_ids, forward))
+        return res
+
+    def closure_AB(self, start_list):
+        return self._closure_nodes(start_list, True)
+    def closure_BA(self, start_list):
+        return self._closure_nodes(start_list, False)
 
     def check_correct(self):
-        for A, Bs in self._neighbors_A_d.items():
-            for B in Bs:
-                assert A in self._neighbors_B_d[B]
+        num_edges = 0
+        for a, out in enumerate(self._out):
+            if out is None: continue
+            assert len(set(out)) == len(out)
+            assert len(self._out_pos[a]) == len(out)
+            for b, p in zip(out, self._out_pos[a]): assert self._in[b][p] == a
+            num_edges += len(out)
+        for b, inc in enumerate(self._in):
+            if inc is None: continue
+            assert len(self._in_pos[b]) == len(inc)
+            for a, p in zip(inc, self._in_pos[b]): assert self._out[a][p] == b
+        assert num_edges == self._num_edges
 
 if __name__ == "__main__":
     graph = Digraph()
     graph.add_node_A(5)
     graph.add_node_B(10)
-    graph.add_edge(a0, b0)
+    graph.add_edge(5, 10)
+    graph.check_correct()
+    print(graph.closure_AB([5]), graph.closure_BA([10]))
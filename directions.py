@@ -17,12 +17,12 @@ def dir_shift(d, coor):
     elif d == LEFT: return (coor[0], coor[1]-1)
     elif d == RIGHT: return (coor[0], coor[1]+1)
     else: raise Exception("unexpected direction {}".format(d))
-def dir_shift_array(d, arr):
+def dir_shift_array(d, arr): # shifts the last two axes
     res = np.zeros_like(arr)
-    if d == UP: res[:-1] = arr[1:]
-    elif d == DOWN: res[1:] = arr[:-1]
-    elif d == LEFT: res[:,:-1] = arr[:,1:]
-    elif d == RIGHT: res[:,1:] = arr[:,:-1]
+    if d == UP: res[...,:-1,:] = arr[...,1:,:]
+    elif d == DOWN: res[...,1:,:] = arr[...,:-1,:]
+    elif d == LEFT: res[...,:-1] = arr[...,1:]
+    elif d == RIGHT: res[...,1:] = arr[...,:-1]
     else: raise Exception("unexpected direction {}".format(d))
     return res
 
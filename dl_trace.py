@@ -0,0 +1,165 @@
+import numpy as np
+import struct
+
+# Binary trace of the operations on a DeadlockStack (add, remove, set_descendants,
+# full deadlocks added from outside, deadlocks dropped from the set by compaction),
+# enough to replay them on a fresh DeadlockStack (see replay_trace.py).
+# Deadlocks added to the stack are referenced by their order of adding,
+# other full deadlocks (loaded from a file, added by add_full_blocks) by -(full_index+1).
+#
+# header: magic, version, height, width
+# records (little endian), starting by the operation byte:
+#   ADD: id u32, stack_index i32, num_boxes u16, num_not_boxes u16,
+#        boxes and not_boxes as (y,x) u8 pairs, packed sk_component
+#   REMOVE: num u32, ids i32
+#   SET_DESC: id i32, num u32, then (y u8, x u8, d u8, descendant i32) per action
+#   LOADED: number of the full deadlocks loaded from the file u32
+#   ADD_FULL: num u32, then per deadlock of the block
+#        full_index i32, num_boxes u16, num_not_boxes u16, num_actions u32,
+#        boxes and not_boxes as (y,x) u8 pairs, packed sk_component, actions as in SET_DESC
+#   DROP: as REMOVE, the deadlocks are only removed from the deadlock set
+# (version 1 traces have only ADD, REMOVE and SET_DESC)
+
+_trace_magic = b'SDLT'
+_trace_version = 2
+_header = struct.Struct("<4sIHH")
+OP_ADD, OP_REMOVE, OP_SET_DESC, OP_LOADED, OP_ADD_FULL, OP_DROP = 1, 2, 3, 4, 5, 6
+_add_header = struct.Struct("<IiHH")
+_full_header = struct.Struct("<iHHI")
+_action = struct.Struct("<BBBi")
+
+class TraceWriter:
+    def __init__(self, fname, shape):
+        self.shape = tuple(shape)
+        self.f = open(fname, 'wb')
+        self.f.write(_header.pack(_trace_magic, _trace_version, *self.shape))
+        self.ids = dict() # deadlock -> id
+        self.next_id = 0
+
+    def ref(self, deadlock):
+        dl_id = self.ids.get(deadlock)
+        if dl_id is not None: return dl_id
+        assert deadlock.full_index is not None
+        return -(deadlock.full_index+1)
+
+    def add(self, deadlock, stack_index):
+        dl_id = self.next_id
+        self.next_id += 1
+        self.ids[deadlock] = dl_id
+        boxes = tuple(deadlock.boxes)
+        not_boxes = tuple(deadlock.not_boxes)
+        self.f.write(bytes([OP_ADD]))
+        self.f.write(_add_header.pack(dl_id, stack_index, len(boxes), len(not_boxes)))
+        self.f.write(bytes(int(c) for pos in boxes+not_boxes for c in pos))
+        self.f.write(np.packbits(deadlock.sk_component, axis = None).tobytes())
+
+    def _write_refs(self, op, deadlocks):
+        refs = [self.ref(deadlock) for deadlock in deadlocks]
+        self.f.write(bytes([op]))
+        self.f.write(struct.pack("<I{}i".format(len(refs)), len(refs), *refs))
+    def remove(self, deadlocks): self._write_refs(OP_REMOVE, deadlocks)
+    def drop(self, deadlocks): self._write_refs(OP_DROP, deadlocks)
+
+    def _write_actions(self, pushes, descendants):
+        for (y,x,d), descendant in zip(pushes, descendants):
+            self.f.write(_action.pack(y, x, d, self.ref(descendant)))
+    def set_descendants(self, deadlock, pushes, descendants):
+        self.f.write(bytes([OP_SET_DESC]))
+        self.f.write(struct.pack("<iI", self.ref(deadlock), len(pushes)))
+        self._write_actions(pushes, descendants)
+
+    def loaded(self, count):
+        self.f.write(bytes([OP_LOADED]))
+        self.f.write(struct.pack("<I", count))
+
+    # a block of full deadlocks with their full indices already set
+    def add_full(self, block):
+        self.f.write(bytes([OP_ADD_FULL]))
+        self.f.write(struct.pack("<I", len(block)))
+        for deadlock in block:
+            boxes = tuple(deadlock.boxes)
+            not_boxes = tuple(deadlock.not_boxes)
+            self.f.write(_full_header.pack(deadlock.full_index, len(boxes), len(not_boxes),
+                                           len(deadlock.descendants)))
+            self.f.write(bytes(int(c) for pos in boxes+not_boxes for c in pos))
+            self.f.write(np.packbits(deadlock.sk_component, axis = None).tobytes())
+            self._write_actions(deadlock.descendants.keys(), deadlock.descendants.values())
+
+    # the removed deadlocks are not referenced anymore
+    def forget(self, deadlocks):
+        for deadlock in deadlocks: self.ids.pop(deadlock, None)
+
+    def close(self):
+        self.f.close()
+
+def _read_exact(f, n):
+    data = f.read(n)
+    if len(data) < n: raise EOFError()
+    return data
+
+# yields (OP_ADD, id, stack_index, boxes, not_boxes, sk_component)
+#        (OP_REMOVE, ids)
+#        (OP_SET_DESC, id, actions, descendant_ids)
+#        (OP_LOADED, count)
+#        (OP_ADD_FULL, [(full_index, boxes, not_boxes, sk_component, actions, descendant_ids)])
+#        (OP_DROP, ids)
+# a torn last record is ignored
+def read_trace(fname):
+    with open(fname, 'rb') as f:
+        magic, version, h, w = _header.unpack(_read_exact(f, _header.size))
+        assert magic == _trace_magic and version in (1, _trace_version)
+        sk_nbytes = (h*w+7)//8
+        def read_sk_component():
+            return np.unpackbits(
+                np.frombuffer(_read_exact(f, sk_nbytes), dtype = np.uint8),
+                count = h*w,
+            ).reshape(h,w).astype(bool)
+        def read_positions(num_boxes, num_not_boxes):
+            positions = _read_exact(f, 2*(num_boxes+num_not_boxes))
+            positions = tuple(zip(positions[::2], positions[1::2]))
+            return positions[:num_boxes], positions[num_boxes:]
+        def read_actions(num):
+            actions = []
+            descendants = []
+            for _ in range(num):
+                y,x,d,desc = _action.unpack(_read_exact(f, _action.size))
+                actions.append((y,x,d))
+                descendants.append(desc)
+            return actions, descendants
+        def read_ids():
+            num, = struct.unpack("<I", _read_exact(f, 4))
+            return struct.unpack("<{}i".format(num), _read_exact(f, 4*num))
+        while True:
+            op = f.read(1)
+            if not op: return
+            op = op[0]
+            try:
+                if op == OP_ADD:
+                    dl_id, stack_index, num_boxes, num_not_boxes = \
+                        _add_header.unpack(_read_exact(f, _add_header.size))
+                    boxes, not_boxes = read_positions(num_boxes, num_not_boxes)
+                    yield (OP_ADD, dl_id, stack_index, boxes, not_boxes, read_sk_component())
+                elif op in (OP_REMOVE, OP_DROP):
+                    yield op, read_ids()
+                elif op == OP_SET_DESC:
+                    dl_id, num = struct.unpack("<iI", _read_exact(f, 8))
+                    actions, descendants = read_actions(num)
+                    yield OP_SET_DESC, dl_id, actions, descendants
+                elif op == OP_LOADED:
+                    count, = struct.unpack("<I", _read_exact(f, 4))
+                    yield OP_LOADED, count
+                elif op == OP_ADD_FULL:
+                    num, = struct.unpack("<I", _read_exact(f, 4))
+                    block = []
+                    for _ in range(num):
+                        full_index, num_boxes, num_not_boxes, num_actions = \
+                            _full_header.unpack(_read_exact(f, _full_header.size))
+                        boxes, not_boxes = read_positions(num_boxes, num_not_boxes)
+                        sk_component = read_sk_component()
+                        actions, descendants = read_actions(num_actions)
+                        block.append((full_index, boxes, not_boxes, sk_component,
+                                      actions, descendants))
+                    yield OP_ADD_FULL, block
+                else: raise Exception("unexpected trace operation {}".format(op))
+            except EOFError:
+                return
@@ -3,10 +3,40 @@ from helpers import *
 from directions import *
 from component2d import *
 
-def heurictic_to_storage(state, fw_mode = True, storages = None):
+# static_tables (see static_tables.py) replace the search from the storages
+# if they match, and moves to dead squares get a penalty
+# jump_map of the squares free of sub_boxes is used if given (MoveStack.get_jump_map),
+# it is left unchanged
+def heurictic_to_storage(state, fw_mode = True, storages = None, static_tables = None,
+                         dead_penalty = -8, jump_map = None):
     if storages is None: storages = state.storages
     cur_avail = state.available & ~state.sub_boxes
-    jump_map = create_jump_map(cur_avail)
+    if jump_map is None: jump_map = create_jump_map(cur_avail)
+    if static_tables is not None and static_tables.has_targets(storages, fw_mode):
+        res = static_tables.toward_target(fw_mode)
+    else: res = storages_jumps_heuristic(state, fw_mode, storages, cur_avail, jump_map)
+
+    box_jumps = find_all_box_jumps(
+        cur_avail,
+        state.sub_boxes,
+        state.storekeepers,
+        fw_mode,
+        jump_map = jump_map
+    )
+    for box, (fst_dir, _) in box_jumps.items():
+        res[box] = False
+        if storages[box]: continue
+        for d in directions:
+            if ((fst_dir == d).any(axis = -1) & storages).any():
+                res[box+(d,)] = True
+                #print("To storage", box, dir_to_str(box_d))
+
+    res = res[1:-1,1:-1].astype(int) * 2
+    if static_tables is not None:
+        res[static_tables.to_dead_square(fw_mode)[1:-1,1:-1]] = dead_penalty
+    return res
+
+def storages_jumps_heuristic(state, fw_mode, storages, cur_avail, jump_map):
     storages_start = []
     for stor in positions_true(storages & ~state.sub_boxes):
         for d in directions:
@@ -27,19 +57,4 @@ def heurictic_to_storage(state, fw_mode = True, storages = None):
     else:
         res = np.zeros(state.available.shape + (4,))
 
-    box_jumps = find_all_box_jumps(
-        cur_avail,
-        state.sub_boxes,
-        state.storekeepers,
-        fw_mode,
-        jump_map = jump_map
-    )
-    for box, (fst_dir, _) in box_jumps.items():
-        res[box] = False
-        if storages[box]: continue
-        for d in directions:
-            if ((fst_dir == d).any(axis = -1) & storages).any():
-                res[box+(d,)] = True
-                #print("To storage", box, dir_to_str(box_d))
-
-    return res[1:-1,1:-1].astype(int) * 2
+    return res
@@ -0,0 +1,176 @@
+import numpy as np
+
+from directions import dir_shift
+from helpers import positions_true
+from static_tables import box_distances, UNREACHABLE
+
+# Lower bound on the number of box moves (pushes in the forward mode,
+# pulls in the backward mode) bringing every box (sub_boxes) on a storage:
+# the minimum cost matching of the boxes to the storages, the cost of a pair
+# is the box distance on the empty board (see static_tables.box_distances).
+#
+# The matching is found by shortest augmenting paths with column potentials
+# (Hungarian algorithm), rows are the boxes, the storages left over are matched
+# to dummy rows of zero cost. When a single box moves, only its row changes,
+# so the box is unassigned and a single augmenting path restores the optimum.
+
+INF = 1 << 30 # cost of an unreachable storage
+
+class Assignment:
+    __slots__ = ["cost", "v", "row_to_col", "col_to_row"]
+
+    def __init__(self, cost, init = True):
+        self.cost = cost # square int64 array [rows, cols]
+        if not init: return
+        n = len(cost)
+        self.v = np.zeros(n, dtype = np.int64)
+        self.row_to_col = np.full(n, -1)
+        self.col_to_row = np.full(n, -1)
+        for row in range(n): self._augment(row)
+
+    def clone(self):
+        res = Assignment(np.array(self.cost), init = False)
+        res.v = np.array(self.v)
+        res.row_to_col = np.array(self.row_to_col)
+        res.col_to_row = np.array(self.col_to_row)
+        return res
+
+    def total(self):
+        return int(self.cost[np.arange(len(self.cost)), self.row_to_col].sum())
+
+    def change_row(self, row, cost_row):
+        col = self.row_to_col[row]
+        self.col_to_row[col] = -1
+        self.row_to_col[row] = -1
+        self.cost[row] = cost_row
+        self._augment(row)
+
+    # Dijkstra on the reduced costs cost[i,j] - u[i] - v[j] from a free row
+    # to a free column, the row potentials u are implied by the tight
+    # matched pairs, u[i] = cost[i, row_to_col[i]] - v[row_to_col[i]]
+    def _augment(self, row):
+        cost, v = self.cost, self.v
+        n = len(cost)
+        dist = cost[row] - v
+        dist -= dist.min()
+        pred = np.full(n, row)
+        scanned = np.zeros(n, dtype = bool)
+        while True:
+            col = int(np.argmin(np.where(scanned, np.iinfo(np.int64).max, dist)))
+            scanned[col] = True
+            i = self.col_to_row[col]
+            if i < 0: break
+            new_dist = dist[col] + cost[i] - cost[i,col] + v[col] - v
+            better = ~scanned & (new_dist < dist)
+            dist[better] = new_dist[better]
+            pred[better] = i
+        # potentials keep the matched pairs tight and the others nonnegative
+        v[scanned] -= dist[col] - dist[scanned]
+        while True:
+            i = pred[col]
+            next_col = self.row_to_col[i]
+            self.col_to_row[col] = i
+            self.row_to_col[i] = col
+            if i == row: break
+            col = next_col
+
+# Heuristic for MoveStack.choose_action: the logit of a box move is
+# weight * (decrease of the lower bound), clipped to a single move,
+# moves after which a box cannot reach any free storage get dead_penalty.
+# The last assignment is kept, so the next call after a push or undo
+# of the same stack is an incremental update.
+class HungarianHeuristic:
+    def __init__(self, static_tables = None, weight = 2, dead_penalty = -8):
+        self.weight = weight
+        self.dead_penalty = dead_penalty
+        self.dists = dict() # (fw_mode, storage) -> box distances
+        if static_tables is not None:
+            for fw_mode in (False, True):
+                targets = positions_true(static_tables.targets[fw_mode])
+                for target, dists in zip(targets, static_tables.target_dists[fw_mode]):
+                    self.dists[fw_mode, tuple(map(int, target))] = dists
+        self._storage_dists = None # (fw_mode, storages, [num_storages, height, width])
+        self._last = None # (fw_mode, storages, boxes, assignment)
+
+    def storage_dists(self, available, storages, fw_mode):
+        key = (fw_mode, np.packbits(storages).tobytes())
+        if self._storage_dists is not None and self._storage_dists[:2] == key:
+            return self._storage_dists[2]
+        dists = []
+        for storage in positions_true(storages):
+            storage = tuple(map(int, storage))
+            d = self.dists.get((fw_mode, storage))
+            if d is None:
+                d = box_distances(available, storage, fw_mode)
+                self.dists[fw_mode, storage] = d
+            dists.append(d)
+        dists = np.array(dists, dtype = np.int64).reshape(-1, *available.shape)
+        dists[dists == UNREACHABLE] = INF
+        self._storage_dists = key + (dists,)
+        return dists
+
+    # returns (boxes, assignment), None if there are more boxes than storages
+    def assignment(self, state, fw_mode = True, storages = None):
+        if storages is None: storages = state.storages
+        dists = self.storage_dists(state.available, storages, fw_mode)
+        num_storages = len(dists)
+        boxes = [tuple(map(int, box)) for box in positions_true(state.sub_boxes)]
+        if len(boxes) > num_storages: return None
+        key = (fw_mode, self._storage_dists[1])
+
+        if self._last is not None and self._last[:2] == key:
+            _, _, last_boxes, assignment = self._last
+            if len(last_boxes) == len(boxes):
+                removed = set(last_boxes).difference(boxes)
+                if not removed: return last_boxes, assignment
+                if len(removed) == 1:
+                    added, = set(boxes).difference(last_boxes)
+                    row = last_boxes.index(removed.pop())
+                    boxes = list(last_boxes)
+                    boxes[row] = added
+                    assignment.change_row(row, dists[(slice(None),)+added])
+                    self._last = key + (boxes, assignment)
+                    return boxes, assignment
+
+        cost = np.zeros((num_storages, num_storages), dtype = np.int64)
+        if boxes: cost[:len(boxes)] = dists[(slice(None),)+tuple(zip(*boxes))].T
+        assignment = Assignment(cost)
+        self._last = key + (boxes, assignment)
+        return boxes, assignment
+
+    def lower_bound(self, state, fw_mode = True, storages = None):
+        res = self.assignment(state, fw_mode, storages)
+        if res is None: return INF
+        return res[1].total()
+
+    # lower bounds after the box moves (y,x,d) of actions,
+    # None for moves of a box which is not among sub_boxes
+    def move_bounds(self, state, actions, fw_mode = True, storages = None):
+        assignment = self.assignment(state, fw_mode, storages)
+        if assignment is None: return [INF]*len(actions)
+        boxes, assignment = assignment
+        dists = self._storage_dists[2]
+        box_to_row = { box : row for row, box in enumerate(boxes) }
+        res = []
+        for y,x,d in actions:
+            box = (int(y)+1, int(x)+1)
+            row = box_to_row.get(box)
+            if row is None:
+                res.append(None)
+                continue
+            after = assignment.clone()
+            after.change_row(row, dists[(slice(None),)+dir_shift(d, box)])
+            res.append(after.total())
+        return res
+
+    def __call__(self, state, fw_mode = True, storages = None, jump_map = None):
+        h,w = state.available.shape
+        res = np.zeros([h-2, w-2, 4])
+        bound = self.lower_bound(state, fw_mode, storages)
+        if bound >= INF: return res
+        actions = positions_true(state.action_mask(fw_mode = fw_mode))
+        for action, bound_after in zip(actions, self.move_bounds(state, actions, fw_mode, storages)):
+            if bound_after is None: continue
+            if bound_after >= INF: res[action] = self.dead_penalty
+            else: res[action] = self.weight * np.clip(bound - bound_after, -1, 1)
+        return res
@@ -0,0 +1,40 @@
+import os
+
+# Append-only text file kept open for the whole session.
+# Records are flushed after every flush_every records,
+# and synced to the disk after every fsync_every records (never if None).
+# A record interrupted by a crash is left as a torn tail of the file,
+# the readers are expected to detect it (see deadlocks.load_deadlocks).
+
+class AppendJournal:
+    def __init__(self, fname, flush_every = 1, fsync_every = None):
+        self.fname = fname
+        self.flush_every = flush_every
+        self.fsync_every = fsync_every
+        self._f = None
+        self._unflushed = 0
+        self._unsynced = 0
+
+    def append(self, record):
+        if self._f is None: self._f = open(self.fname, 'a')
+        self._f.write(record)
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every: self.flush()
+
+    def flush(self, sync = False):
+        if self._f is None: return
+        if self._unflushed:
+            self._f.flush()
+            self._unsynced += self._unflushed
+            self._unflushed = 0
+        if self._unsynced and (sync or (
+            self.fsync_every is not None and self._unsynced >= self.fsync_every
+        )):
+            os.fsync(self._f.fileno())
+            self._unsynced = 0
+
+    def close(self):
+        if self._f is None: return
+        self.flush(sync = self.fsync_every is not None)
+        self._f.close()
+        self._f = None
@@ -0,0 +1,180 @@
+import os
+
+from move_stack import MoveStack
+from soko_state import level_to_state, level_to_dual_state, dual_action
+from directions import *
+from component2d import find_path
+from heuristic import heurictic_to_storage
+from static_tables import load_static_tables
+from hungarian import HungarianHeuristic
+from minimizer import Minimizer
+
+# headless part of SokoGUI: a pair of forward / dual move stacks
+# for a single level together with the solution export
+
+def get_level_basename(levelset_fname, level_i):
+    levelset_basename, _ = os.path.splitext(os.path.basename(levelset_fname))
+    return levelset_basename + '_l' + str(level_i)
+
+# combines a forward stack and a backward stack into a forward solution
+def stitch_solution(fw_states, fw_actions, bw_states, bw_actions):
+    fw_actions = list(fw_actions)
+    fw_moves = []
+    for state, action in zip(fw_states, fw_actions):
+        fw_moves.extend(state.action_to_basic_moves(action, fw_mode = True))
+    if bw_actions:
+        bw_actions = list(bw_actions)
+        bw_moves = [bw_actions[0][-1]]
+        for state, action in zip(bw_states[1:], bw_actions[1:]):
+            bw_moves.extend(state.action_to_basic_moves(action, fw_mode = False))
+        fw_state = fw_states[-1]
+        bw_state = bw_states[-1]
+        fw_moves.extend(
+            find_path(
+                fw_state.available & ~fw_state.sub_boxes,
+                fw_state.storekeeper,
+                bw_state.storekeeper,
+            )
+        )
+        bw_actions.reverse()
+        bw_moves.reverse()
+        fw_actions.extend(dual_action(a) for a in bw_actions)
+        fw_moves.extend(op_dir(d) for d in bw_moves)
+    return fw_moves, fw_actions
+
+def save_solution(level_var_dir, fw_moves, fw_actions):
+    sol_fname = "solution_{}_{}".format(len(fw_moves), len(fw_actions))
+    move_fname = os.path.join(level_var_dir, sol_fname+".mov")
+    action_fname = os.path.join(level_var_dir, sol_fname+".act")
+    with open(move_fname, 'w') as f:
+        f.write(''.join(
+            dir_to_c(d) for d in fw_moves
+        )+'\n')
+    with open(action_fname, 'w') as f:
+        for y,x,d in fw_actions:
+            print(y, x, dir_to_c(d), file = f)
+    print("Saved solution: {} moves, {} pushes".format(
+        len(fw_moves), len(fw_actions)))
+    return move_fname
+
+class LevelSession:
+    def __init__(self, level, level_basename, var_dir = 'var', fw_mode = True,
+                 dl_flush_every = 1, dl_fsync_every = None, trace = False,
+                 dl_debug_depth = 10000, heuristic = "storage", dl_compact = False,
+                 minimize = 0, minimize_steps = 1000):
+        state = level_to_state(level)
+        dual_state = level_to_dual_state(level)
+        level_var_dir = os.path.join(var_dir, level_basename)
+        os.makedirs(level_var_dir, exist_ok = True)
+        dl_fname = os.path.join(level_var_dir, 'deadlocks')
+        dual_dl_fname = os.path.join(level_var_dir, 'dual_deadlocks')
+        print('Preparing forward stack')
+        move_stack = MoveStack(state, dl_fname = dl_fname,
+                               dl_flush_every = dl_flush_every,
+                               dl_fsync_every = dl_fsync_every,
+                               dl_trace_fname = dl_fname+".trace" if trace else None,
+                               dl_debug_depth = dl_debug_depth,
+                               dl_compact = dl_compact)
+        print('Preparing backward stack')
+        dual_move_stack = MoveStack(dual_state, dl_fname = dual_dl_fname, fw_mode = False,
+                                    dl_flush_every = dl_flush_every,
+                                    dl_fsync_every = dl_fsync_every,
+                                    dl_trace_fname = dual_dl_fname+".trace" if trace else None,
+                                    dl_debug_depth = dl_debug_depth,
+                                    dl_compact = dl_compact)
+        self.move_stacks = [
+            dual_move_stack, move_stack
+        ]
+        # background minimization of new full deadlocks by 'minimize' processes
+        if minimize:
+            self.minimizer = Minimizer(level, self.move_stacks, processes = minimize,
+                                       max_steps = minimize_steps)
+        else: self.minimizer = None
+        self.static_tables = load_static_tables(level_var_dir, state, dual_state)
+        # "storage": heurictic_to_storage, "hungarian": HungarianHeuristic
+        if heuristic == "hungarian":
+            self.hungarian = [HungarianHeuristic(self.static_tables) for _ in range(2)]
+        elif heuristic == "storage": self.hungarian = None
+        else: raise Exception("unknown heuristic {}".format(heuristic))
+        self.fw_mode = fw_mode
+        self.was_solved = False
+        self.level = level
+        self.level_var_dir = level_var_dir
+        self.level_basename = level_basename
+
+    def close(self):
+        if self.minimizer is not None: self.minimizer.close()
+        for move_stack in self.move_stacks: move_stack.close()
+
+    @property
+    def move_stack(self): return self.move_stacks[self.fw_mode]
+    @property
+    def dual_move_stack(self): return self.move_stacks[not self.fw_mode]
+    @property
+    def state(self): return self.move_stack.state
+    @property
+    def base_state(self): return self.move_stack.base_state
+    @property
+    def dual_state(self): return self.dual_move_stack.base_state
+    @property
+    def storekeeper_goal(self):
+        if self.fw_mode and self.dual_move_stack.is_on_start():
+            return None
+        sk = self.dual_move_stack.state.storekeeper
+        if self.dual_state.storekeepers[sk]: return sk
+        else: return self.dual_state.storekeeper
+
+    def heuristic(self, state, fw_mode, jump_map = None):
+        storages = self.dual_state.sub_boxes
+        if self.hungarian is not None:
+            return self.hungarian[fw_mode](state, fw_mode, storages = storages)
+        return heurictic_to_storage(state, fw_mode, storages = storages,
+                                    static_tables = self.static_tables,
+                                    jump_map = jump_map)
+
+    def is_solved(self):
+        is_solved = self.state.is_solved(
+            other_goal = (self.dual_state.sub_boxes, self.storekeeper_goal)
+        )
+        if is_solved and not self.move_stack.was_generalized() and not self.was_solved:
+            self.was_solved = True
+            bw_move_stack, fw_move_stack = self.move_stacks
+            fw_moves, fw_actions = stitch_solution(
+                fw_move_stack.get_past_states(), fw_move_stack.get_past_actions(),
+                bw_move_stack.get_past_states(), bw_move_stack.get_past_actions(),
+            )
+            save_solution(self.level_var_dir, fw_moves, fw_actions)
+
+        return is_solved
+
+    def search_step(self, min_move = 0):
+        if self.minimizer is not None: self.minimizer.collect()
+        if self.is_solved(): return False
+        if self.move_stack.redo():
+            if self.move_stack.is_locked(): self.move_stack.undo()
+            else: return True
+
+        if self.move_stack.search_step(heuristic = self.heuristic, min_move = min_move):
+            return True
+        if self.move_stack.is_solved(): self.dual_move_stack.reset()
+        return False
+
+    def auto_move(self):
+        if not self.state.sub_full:
+            self.move_stack.change_sub_boxes(self.base_state.sub_boxes)
+
+        if self.is_solved():
+            if self.dual_move_stack.is_on_start(): return False
+            action = dual_action(self.dual_move_stack.last_action)
+            if not self.move_stack.is_on_end() and action == self.move_stack.next_action:
+                self.move_stack.redo()
+            else: self.move_stack.apply_action(action)
+            self.dual_move_stack.undo()
+            return True
+        elif self.move_stack.redo(): return True
+        else:
+            action = self.move_stack.choose_action(
+                heuristic = self.heuristic)
+            if action is None: return False
+            self.move_stack.apply_action(action)
+            return True
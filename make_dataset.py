@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import numpy as np
+
+from data_loader import LevelSet
+from directions import *
+from soko_state import level_to_state, level_to_dual_state, SokoStateBatch
+from deadlocks import iter_deadlock_blocks
+from level_session import get_level_basename
+
+# Dataset of SokoState.export() tensors from the 'var' directory of a levelset:
+#   positions on the saved solutions (label 1, action = the solution push),
+#   forward and dual deadlocks (label 0, action = -1).
+# Every level gets its own directory of shards, a shard consists of the files
+#   {field}_{shard:05}.npy
+# for the fields
+#   export      [n, height, width, 5] bool, see SokoState.export
+#   action_mask [n, height, width, 4] bool, in the direction of fw_mode
+#   fw_mode     [n] bool, False for the dual deadlocks
+#   label       [n] int8
+#   action      [n] int32, index into the flattened action_mask or -1
+# The files can be loaded with np.load(..., mmap_mode = 'r').
+
+fields = ("export", "action_mask", "fw_mode", "label", "action")
+
+class ShardWriter:
+    def __init__(self, out_dir, shard_size):
+        self.out_dir = out_dir
+        self.shard_size = shard_size
+        self.num_shards = 0
+        self.num_samples = 0
+        self.buffer = []
+
+    def add(self, state, fw_mode, label, action = None):
+        self.buffer.append((state, fw_mode, label, action))
+        if len(self.buffer) >= self.shard_size: self.flush()
+
+    def flush(self):
+        if not self.buffer: return
+        os.makedirs(self.out_dir, exist_ok = True)
+        states, fw_modes, labels, actions = zip(*self.buffer)
+        batch = SokoStateBatch.from_states(states)
+        fw_mode = np.array(fw_modes)
+        action_mask = np.where(
+            fw_mode[:,None,None,None],
+            batch.action_mask(fw_mode = True),
+            batch.action_mask(fw_mode = False),
+        )
+        mask_shape = action_mask.shape[1:]
+        data = dict(
+            export = batch.export(),
+            action_mask = action_mask,
+            fw_mode = fw_mode,
+            label = np.array(labels, dtype = np.int8),
+            action = np.array([
+                -1 if action is None else np.ravel_multi_index(action, mask_shape)
+                for action in actions
+            ], dtype = np.int32),
+        )
+        for field in fields:
+            fname = os.path.join(self.out_dir, "{}_{:05}.npy".format(field, self.num_shards))
+            np.save(fname, data[field])
+        self.num_shards += 1
+        self.num_samples += len(self.buffer)
+        self.buffer = []
+
+def load_actions(fname):
+    actions = []
+    with open(fname) as f:
+        for line in f:
+            if not line.strip(): continue
+            y,x,d = line.split()
+            actions.append((int(y), int(x), c_to_dir[d]))
+    return actions
+
+def level_dataset(level_i, levels, args):
+    level_basename = get_level_basename(args.levelset, level_i)
+    level_var_dir = os.path.join(args.var_dir, level_basename)
+    out_dir = os.path.join(args.out_dir, level_basename)
+    writer = ShardWriter(out_dir, args.shard_size)
+    level = levels[level_i-1]
+
+    for sol_fname in sorted(glob.glob(os.path.join(level_var_dir, "solution_*.act"))):
+        state = level_to_state(level)
+        for action in load_actions(sol_fname):
+            writer.add(state, True, 1, action)
+            state = state.move(*action)
+
+    for dl_name, base_state, fw_mode in (
+            ("deadlocks", level_to_state(level), True),
+            ("dual_deadlocks", level_to_dual_state(level), False),
+    ):
+        dl_fname = os.path.join(level_var_dir, dl_name)
+        if not os.path.exists(dl_fname): continue
+        for block in iter_deadlock_blocks(dl_fname, base_state):
+            for deadlock in block:
+                writer.add(deadlock.to_soko_state(base_state), fw_mode, 0)
+
+    writer.flush()
+    return dict(
+        level = level_i,
+        dir = level_basename,
+        shards = writer.num_shards,
+        samples = writer.num_samples,
+    )
+
+_levels = None
+_args = None
+def _init_worker(args):
+    global _levels, _args
+    _args = args
+    _levels = LevelSet(args.levelset)
+
+def _level_dataset_worker(level_i):
+    return level_dataset(level_i, _levels, _args)
+
+if __name__ == "__main__":
+    from batch_search import parse_level_list
+
+    parser = argparse.ArgumentParser(prog='make_dataset',
+                                     description='Export solutions and deadlocks into numpy shards',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('levelset', type=str, help='file to load the level set (in xsb format)')
+    parser.add_argument('out_dir', type=str, help='output directory')
+    parser.add_argument('--levels', type=str, default = None,
+                        help='levels to export, e.g. "1-10,15", all by default')
+    parser.add_argument('--var_dir', type=str, default = 'var')
+    parser.add_argument('--processes', type=int, default = os.cpu_count())
+    parser.add_argument('--shard_size', type=int, default = 4096, help='samples per shard')
+    args = parser.parse_args()
+
+    level_list = parse_level_list(args.levels, len(LevelSet(args.levelset)))
+    os.makedirs(args.out_dir, exist_ok = True)
+
+    index = []
+    with multiprocessing.Pool(args.processes, initializer = _init_worker,
+                              initargs = (args,)) as pool:
+        for res in pool.imap_unordered(_level_dataset_worker, level_list):
+            if res['samples']:
+                print("Level {}: {} samples, {} shards".format(
+                    res['level'], res['samples'], res['shards']))
+                index.append(res)
+
+    index.sort(key = lambda res: res['level'])
+    with open(os.path.join(args.out_dir, "index.json"), 'w') as f:
+        json.dump(index, f, indent = 1)
+    print("{} samples from {} levels".format(sum(res['samples'] for res in index), len(index)))
@@ -0,0 +1,134 @@
+import csv
+import functools
+import json
+import os
+import time
+from collections import defaultdict
+
+# Counters and timers of the search, collected only when enabled
+# (the instrumented code checks metrics.enabled first).
+# Names are dot separated, e.g. "find.candidates", "scc.size.3".
+#
+#   metrics.enable()
+#   ... search ...
+#   metrics.snapshot() / metrics.dump_json(fname) / metrics.dump_csv(fname)
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.counters = defaultdict(int)
+        self.timers = defaultdict(float) # seconds
+        self.dump_fname = None
+        self.dump_interval = None
+        self._last_dump = None
+
+    def enable(self, enabled = True): self.enabled = enabled
+    def reset(self):
+        self.counters.clear()
+        self.timers.clear()
+
+    def count(self, name, n = 1):
+        self.counters[name] += n
+    def add_time(self, name, seconds):
+        self.timers[name] += seconds
+        self.counters[name+".calls"] += 1
+
+    def snapshot(self):
+        return dict(
+            counters = dict(sorted(self.counters.items())),
+            timers = dict(sorted(self.timers.items())),
+        )
+    def dump_json(self, fname):
+        tmp_fname = fname+".tmp"
+        with open(tmp_fname, 'w') as f:
+            json.dump(self.snapshot(), f, indent = 1)
+        os.replace(tmp_fname, fname)
+    def dump_csv(self, fname):
+        with open(fname, 'w', newline = '') as f:
+            writer = csv.writer(f)
+            writer.writerow(["kind", "name", "value"])
+            for name, value in sorted(self.counters.items()):
+                writer.writerow(["counter", name, value])
+            for name, value in sorted(self.timers.items()):
+                writer.writerow(["timer", name, value])
+
+    # tick() then dumps to fname (.json or .csv) at most every interval seconds
+    def dump_periodically(self, fname, interval):
+        self.dump_fname = fname
+        self.dump_interval = interval
+        self._last_dump = time.time()
+    def dump(self, fname = None):
+        if fname is None: fname = self.dump_fname
+        if fname.endswith(".csv"): self.dump_csv(fname)
+        else: self.dump_json(fname)
+    def tick(self):
+        if self.dump_fname is None: return
+        now = time.time()
+        if now - self._last_dump >= self.dump_interval:
+            self._last_dump = now
+            self.dump()
+
+metrics = Metrics()
+
+# decorator measuring the time of a function when the metrics are enabled
+def timed(name):
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled: return f(*args, **kwargs)
+            start = time.perf_counter()
+            try: return f(*args, **kwargs)
+            finally: metrics.add_time(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+# exclusive time of nested phases, a phase running inside another one
+# is not counted in the outer one
+class PhaseTimer:
+    def __init__(self):
+        self.totals = dict()
+        self.stack = [] # [phase, start]
+
+    def start(self, phase):
+        now = time.perf_counter()
+        if self.stack:
+            outer, start = self.stack[-1]
+            self.totals[outer] = self.totals.get(outer, 0.) + now - start
+        self.stack.append([phase, now])
+    def stop(self):
+        now = time.perf_counter()
+        phase, start = self.stack.pop()
+        self.totals[phase] = self.totals.get(phase, 0.) + now - start
+        if self.stack: self.stack[-1][1] = now
+
+    def wrap(self, f, phase):
+        def wrapper(*args, **kwargs):
+            self.start(phase)
+            try: return f(*args, **kwargs)
+            finally: self.stop()
+        return wrapper
+    def wrap_gen(self, f, phase):
+        def wrapper(*args, **kwargs):
+            gen = f(*args, **kwargs)
+            while True:
+                self.start(phase)
+                try: x = next(gen)
+                except StopIteration: return
+                finally: self.stop()
+                yield x
+        return wrapper
+
+    # replaces methods of classes: [(cls, method_name, phase, is_generator)]
+    def instrument(self, methods):
+        for cls, name, phase, is_gen in methods:
+            f = getattr(cls, name)
+            if is_gen: setattr(cls, name, self.wrap_gen(f, phase))
+            else: setattr(cls, name, self.wrap(f, phase))
+
+# runs f(*args) under cProfile if prof_fname is not None, storing the stats there
+def maybe_profile(prof_fname, f, *args, **kwargs):
+    if prof_fname is None: return f(*args, **kwargs)
+    import cProfile
+    profile = cProfile.Profile()
+    try: return profile.runcall(f, *args, **kwargs)
+    finally: profile.dump_stats(prof_fname)
@@ -0,0 +1,214 @@
+import contextlib
+import multiprocessing
+import os
+from itertools import chain
+import numpy as np
+
+from soko_state import SokoState, level_to_state, level_to_dual_state
+from move_stack import MoveStack
+from deadlocks import Deadlock, DeadlockSet, deadlocks_from_file
+from metrics import metrics
+from component2d import get_component
+from helpers import positions_true
+
+# Background minimization of new full deadlocks. A pool of worker processes
+# greedily tries to remove the boxes of a deadlock (the square becomes
+# unknown) and then to unblock its blocked squares, every candidate is verified
+# by a headless search (MoveStack.search_step with a step budget) from the
+# generalized state against the deadlocks saved in the deadlock file so far.
+# The workers only read the deadlock files, the new full blocks proving
+# the most general accepted candidate are sent back and saved by the main process
+# (DeadlockStack.add_full_blocks), which then relocks its stack (MoveStack.recheck_full).
+#
+# A deadlock sent back is (boxes, not_boxes, sk_component, [(action, ref)]),
+# ref >= 0 is the index among the sent deadlocks, ref < 0 is the existing
+# full deadlock -(ref+1), as in dl_trace.py.
+
+class _SavedDeadlocks:
+    def __init__(self, fname, base_state):
+        self.fname = fname
+        self.base_state = base_state
+        self.deadlocks = [] # by full_index
+        self.end = 0 # read prefix of the file
+        self.dl_set = DeadlockSet()
+
+    # reads the blocks finished in the file since the last call
+    def update(self):
+        if not os.path.exists(self.fname): return
+        # the main process keeps appending, the blocks finished later are read next time
+        size = os.path.getsize(self.fname)
+        blocks, self.end = deadlocks_from_file(
+            self.fname, self.base_state, start = self.end,
+            prev_deadlocks = self.deadlocks, torn_tail = True, size = size,
+        )
+        for block in blocks:
+            for deadlock in block:
+                self.deadlocks.append(deadlock)
+                self.dl_set.add(deadlock)
+
+_saved = None
+_max_steps = None
+def _init_worker(level, fnames, max_steps):
+    global _saved, _max_steps
+    _max_steps = max_steps
+    _saved = [
+        _SavedDeadlocks(fnames[False], level_to_dual_state(level)),
+        _SavedDeadlocks(fnames[True], level_to_state(level)),
+    ]
+
+# the storekeeper component grows to the squares of removed boxes,
+# as when the deadlock is read from a file
+def _candidate_state(base_state, boxes, not_boxes, sk_component):
+    sub_boxes = np.zeros_like(base_state.available)
+    sup_boxes = np.array(base_state.available)
+    for box in boxes: sub_boxes[box] = True
+    for nbox in not_boxes: sup_boxes[nbox] = False
+    storekeepers = get_component(base_state.available & ~sub_boxes, positions_true(sk_component))
+    return SokoState(
+        base_state.available, sub_boxes, sup_boxes, base_state.storages,
+        positions_true(storekeepers)[0], storekeepers,
+        storekeeper_goal = base_state.storekeeper_goal,
+    )
+
+# returns the full deadlock of the state if it was proven,
+# the new full blocks are appended to new_blocks
+def _verify(saved, fw_mode, state, new_blocks):
+    dl_set = saved.dl_set
+    move_stack = MoveStack(state, fw_mode = fw_mode, dl_set = dl_set, dl_debug_depth = 0)
+    deadlocks = move_stack.deadlocks
+    deadlocks._last_full_index = len(saved.deadlocks) + sum(map(len, new_blocks)) - 1
+    deadlocks.on_full = new_blocks.append
+    steps = 0
+    while steps < _max_steps and move_stack.search_step(): steps += 1
+    if move_stack.is_on_start() and move_stack.is_locked_full(): res = move_stack.cur_lock
+    else: res = None
+    deadlocks.remove(deadlocks.dependencies.nodes_B()) # temporary deadlocks
+    return res
+
+def _minimize_worker(fw_mode, boxes, not_boxes, sk_component):
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            saved = _saved[fw_mode]
+            saved.update()
+            base_state = saved.base_state
+            new_blocks = []
+            boxes, not_boxes = list(boxes), list(not_boxes)
+            ori_size = len(boxes) + len(not_boxes)
+            minimized = None
+            for squares in (boxes, not_boxes):
+                for square in list(squares):
+                    squares.remove(square)
+                    state = _candidate_state(base_state, boxes, not_boxes, sk_component)
+                    lock = _verify(saved, fw_mode, state, new_blocks)
+                    if lock is None: squares.append(square)
+                    else: minimized = lock
+
+            # only the new blocks proving the most general candidate are sent,
+            # all are forgotten, the sent ones are read from the file later;
+            # a block is a whole stack level, not only an SCC, so the descendants
+            # of all its members are needed
+            known = len(saved.deadlocks)
+            block_of = {
+                deadlock : block_i
+                for block_i, block in enumerate(new_blocks)
+                for deadlock in block
+            }
+            needed = set() # indices of the needed blocks
+            stack = [minimized] if minimized is not None else []
+            while stack:
+                deadlock = stack.pop()
+                if deadlock.full_index < known: continue
+                block_i = block_of[deadlock]
+                if block_i in needed: continue
+                needed.add(block_i)
+                for member in new_blocks[block_i]:
+                    stack.extend(member.descendants.values())
+            for block in new_blocks:
+                for deadlock in block: saved.dl_set.remove(deadlock)
+            new_blocks = [block for block_i, block in enumerate(new_blocks) if block_i in needed]
+            position = {
+                deadlock : i
+                for i, deadlock in enumerate(chain.from_iterable(new_blocks))
+            }
+            def ref(deadlock):
+                if deadlock.full_index < known: return -(deadlock.full_index+1)
+                else: return position[deadlock]
+            out = [
+                [
+                    (dl.boxes, dl.not_boxes, dl.sk_component, [
+                        (action, ref(desc)) for action, desc in dl.descendants.items()
+                    ])
+                    for dl in block
+                ]
+                for block in new_blocks
+            ]
+
+    return fw_mode, out, ori_size - len(boxes) - len(not_boxes)
+
+class Minimizer:
+    def __init__(self, level, move_stacks, processes = 2, max_steps = 1000, max_pending = None):
+        self.move_stacks = move_stacks # [bw, fw]
+        fnames = [move_stack.deadlocks.fname for move_stack in move_stacks]
+        self.pool = multiprocessing.Pool(processes, initializer = _init_worker,
+                                         initargs = (level, fnames, max_steps))
+        if max_pending is None: max_pending = 4*processes
+        self.max_pending = max_pending
+        self.pending = []
+        for fw_mode, move_stack in enumerate(move_stacks):
+            move_stack.deadlocks.on_full = (
+                lambda deadlocks, fw_mode = bool(fw_mode): self.submit(deadlocks, fw_mode)
+            )
+
+    def submit(self, deadlocks, fw_mode):
+        for deadlock in deadlocks:
+            if len(self.pending) >= self.max_pending:
+                if metrics.enabled: metrics.count("minimize.skipped")
+                continue
+            if metrics.enabled: metrics.count("minimize.submitted")
+            self.pending.append(self.pool.apply_async(
+                _minimize_worker,
+                (fw_mode, deadlock.boxes, deadlock.not_boxes, deadlock.sk_component),
+            ))
+
+    # saves the results of the finished tasks, returns the number of new deadlocks
+    def collect(self):
+        res = 0
+        pending = []
+        for task in self.pending:
+            if not task.ready():
+                pending.append(task)
+                continue
+            # a failed minimization only loses its result, the search goes on
+            try: fw_mode, blocks, removed = task.get()
+            except Exception as e:
+                print("Minimization failed: {}: {}".format(type(e).__name__, e))
+                if metrics.enabled: metrics.count("minimize.failed")
+                continue
+            dl_stack = self.move_stacks[fw_mode].deadlocks
+            data = [dl_data for block in blocks for dl_data in block]
+            new = [
+                Deadlock(boxes, not_boxes, sk_component)
+                for boxes, not_boxes, sk_component, _ in data
+            ]
+            for deadlock, (_, _, _, descendants) in zip(new, data):
+                deadlock.descendants = {
+                    action : new[i] if i >= 0 else dl_stack.get_full(-i-1)
+                    for action, i in descendants
+                }
+            new_blocks = []
+            for block in blocks:
+                start = sum(map(len, new_blocks))
+                new_blocks.append(new[start : start+len(block)])
+            dl_stack.add_full_blocks(new_blocks)
+            self.move_stacks[fw_mode].recheck_full(new)
+            res += len(new)
+            if metrics.enabled:
+                metrics.count("minimize.done")
+                metrics.count("minimize.squares_removed", removed)
+                metrics.count("minimize.new_deadlocks", len(new))
+        self.pending = pending
+        return res
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
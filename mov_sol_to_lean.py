@@ -2,7 +2,7 @@
 
 import argparse
 import os
-from data_loader import load_xsb_levels, encode_sokoban_level_to_lines
+from data_loader import LevelSet, encode_sokoban_level_to_lines
 from directions import *
 
 def remove_suffix(s, suff):
@@ -29,7 +29,7 @@ print("-- Levelset:", levelset_fname)
 print("-- Level:", level_i)
 print()
 
-levels = load_xsb_levels(levelset_fname)
+levels = LevelSet(levelset_fname)
 level = levels[level_i-1]
 with open(args.fname) as f:
     line = next(f)
@@ -1,10 +1,12 @@
 import numpy as np
 import itertools
+from collections import OrderedDict, defaultdict
 
 from soko_state import SokoState
 from deadlocks import DeadlockStack
-from component2d import get_component
+from component2d import get_component, create_jump_map, jump_map_add_avail, jump_map_remove_avail
 from helpers import *
+from metrics import metrics, timed
 
 class MoveStack:
     __slots__ = [
@@ -16,10 +18,26 @@ class MoveStack:
         "cur_move_i",   # the current move index
         "deadlocks",    # structure for searching deadlocks
         "first_generalization", # index of first move where state is not sub_full
+        "transpositions", # zobrist hashes of already reached positions, oldest first -> box_hash
+        "tt_box_hashes", # box_hash -> number of transpositions with it
+        "tt_size",      # bound on the number of transpositions, 0 = disabled
+        "jump_map",     # jump map of jump_clear, see get_jump_map
+        "jump_clear",   # squares free of sub_boxes the jump map was built for
     ]
 
-    def __init__(self, first_state, dl_fname = None, fw_mode = True):
-        deadlocks = DeadlockStack(fname = dl_fname, sample_state = first_state)
+    # more changed squares than this rebuild the jump map from scratch
+    jump_map_max_updates = 16
+
+    def __init__(self, first_state, dl_fname = None, fw_mode = True, tt_size = 2**16,
+                 dl_flush_every = 1, dl_fsync_every = None, dl_trace_fname = None,
+                 dl_debug_depth = 10000, dl_compact = False, dl_set = None):
+        deadlocks = DeadlockStack(dl_set = dl_set,
+                                  fname = dl_fname, sample_state = first_state,
+                                  flush_every = dl_flush_every,
+                                  fsync_every = dl_fsync_every,
+                                  trace_fname = dl_trace_fname,
+                                  debug_depth = dl_debug_depth,
+                                  compact = dl_compact)
         self.fw_mode = fw_mode
         self.base_states = [first_state]
         self.gener_states = [first_state]
@@ -30,6 +48,14 @@ class MoveStack:
         self.moves = []
         self.cur_move_i = 0
         self.deadlocks = deadlocks
+        self.transpositions = OrderedDict()
+        self.tt_box_hashes = defaultdict(int)
+        self.tt_size = tt_size
+        self._tt_add(first_state)
+        self.jump_map = None
+        self.jump_clear = None
+
+    def close(self): self.deadlocks.close()
 
     @property
     def state(self): return self.gener_states[self.cur_move_i]
@@ -140,6 +166,44 @@ class MoveStack:
         if self.was_generalized():
             self.cur_move_i = self.first_generalization
 
+    # jump map (see component2d.create_jump_map) of the squares free of sub_boxes
+    # in the current state, updated by the squares changed since the last call,
+    # typically the two squares of a push or undo
+    # callers may modify it temporarily but have to restore it
+    def get_jump_map(self):
+        clear = self.state.available & ~self.state.sub_boxes
+        if self.jump_map is not None:
+            changed = clear != self.jump_clear
+            num_changed = int(np.count_nonzero(changed))
+            if num_changed == 0: return self.jump_map
+            if num_changed <= self.jump_map_max_updates:
+                for pos in positions_true(changed & self.jump_clear):
+                    jump_map_remove_avail(pos, self.jump_map, self.jump_clear)
+                for pos in positions_true(changed & clear):
+                    jump_map_add_avail(pos, self.jump_map, self.jump_clear)
+                if metrics.enabled: metrics.count("jump_map.updates", num_changed)
+                return self.jump_map
+        self.jump_clear = clear
+        self.jump_map = create_jump_map(clear)
+        if metrics.enabled: metrics.count("jump_map.rebuilds")
+        return self.jump_map
+
+    # transposition table, only for positions with all the boxes
+    def _tt_add(self, state):
+        if not self.tt_size or not state.sub_full: return
+        h = state.zobrist()
+        if h in self.transpositions: self.transpositions.move_to_end(h)
+        else:
+            self.transpositions[h] = state.box_hash
+            self.tt_box_hashes[state.box_hash] += 1
+            if len(self.transpositions) > self.tt_size:
+                _, box_hash = self.transpositions.popitem(last = False)
+                self.tt_box_hashes[box_hash] -= 1
+                if not self.tt_box_hashes[box_hash]: del self.tt_box_hashes[box_hash]
+    def is_transposition(self, state):
+        return bool(self.tt_size) and state.sub_full \
+            and state.zobrist() in self.transpositions
+
     # adding to stack without deadlock check
     def _add_move(self, move, next_state, next_state_gener, lock):
         assert self.cur_move_i == len(self.moves)
@@ -151,6 +215,7 @@ class MoveStack:
 
         self.base_states.append(next_state)
         self.gener_states.append(next_state_gener)
+        self._tt_add(next_state)
         if lock is None:
             lock = self.deadlocks.add(next_state_gener, self.cur_move_i)
         self.state_locks.append(lock)
@@ -233,12 +298,13 @@ class MoveStack:
         if not actions: return None
 
         if heuristic is not None:
-            logits_arr = heuristic(self.state, self.fw_mode)
+            logits_arr = heuristic(self.state, self.fw_mode, jump_map = self.get_jump_map())
             logits = [logits_arr[action] for action in actions]
             push_i = np_random_categ(np_softmax(logits))
         else: push_i = 0
         return actions[push_i]
 
+    @timed("search_step")
     def search_step(self, heuristic = None, min_move = 0, auto_generalize = True):
         while True:
             # undo while deadlocked
@@ -248,6 +314,7 @@ class MoveStack:
                     print("Not solvable")
                     return False
                 self.undo()
+                if metrics.enabled: metrics.count("search.undos")
 
             if self.state.is_solved():
                 print("Not a deadlock, each box is on a storage")
@@ -259,21 +326,65 @@ class MoveStack:
 
             if free_actions: # apply an action
 
-                self.apply_action(
-                    self.choose_action(heuristic = heuristic, actions = free_actions),
+                # positions already explored on another branch are avoided
+                # (but not pruned completely, they are not proven to be deadlocks)
+                # (the states are made only for the actions leading to already seen boxes)
+                next_states = dict()
+                if self.tt_size and self.state.sub_full:
+                    new_actions = []
+                    for action in free_actions:
+                        if self.state.moved_box_hash(*action) in self.tt_box_hashes:
+                            next_state = self.state.move(*action, fw_mode = self.fw_mode)
+                            next_states[action] = next_state
+                            if self.is_transposition(next_state): continue
+                        new_actions.append(action)
+                    if new_actions:
+                        if metrics.enabled and len(new_actions) < len(free_actions):
+                            metrics.count("search.transpositions_avoided")
+                        free_actions = new_actions
+
+                action = self.choose_action(heuristic = heuristic, actions = free_actions)
+                next_state = next_states.get(action, None)
+                if next_state is None:
+                    next_state = self.state.move(*action, fw_mode = self.fw_mode)
+                self.add_move(
+                    action, next_state,
                     search_for_lock = False,
                     auto_generalize = auto_generalize,
                 )
+                if metrics.enabled: metrics.count("search.pushes")
                 return True
 
             else: # store a deadlock
+                if metrics.enabled: metrics.count("search.stores")
                 self._recheck_deadlocks_on_path(
                     *self.deadlocks.set_descendants(
                         self.cur_lock, actions, action_locks
                     )
                 )
 
+    # relocks the lowest position of the stack matched by one of the given full
+    # deadlocks proven outside of the search (see minimizer.py),
+    # the moves above it are dropped, returns whether a position was relocked
+    def recheck_full(self, deadlocks):
+        for i in range(self.cur_move_i+1):
+            if self.state_locks[i].stack_index < 0: continue
+            dl = maybe_next(filter(
+                lambda dl: dl.check_state(self.gener_states[i]),
+                deadlocks,
+            ))
+            if dl is None: continue
+            self.set_cur_move_i(i)
+            self.drop_redo()
+            ori_lock = self.state_locks[i]
+            self.state_locks[i] = dl
+            if ori_lock.stack_index == i: self.deadlocks.remove(ori_lock)
+            if metrics.enabled: metrics.count("recheck.relocked_outside")
+            return True
+        return False
+
     # recheck if positions in undo history are blocked by a new full deadlock
+    @timed("recheck")
     def _recheck_deadlocks_on_path(self, scc, to_check, index_to_drop_num):
 
         # helper data for optimization
@@ -318,6 +429,7 @@ class MoveStack:
                 if ori_lock.stack_index == i:
                     dl_to_discard.append(ori_lock)
                 self.state_locks[i] = dl
+                if metrics.enabled: metrics.count("recheck.relocked")
             else:
                 cur_viable = False
 
@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+import argparse
+import time
+
+from deadlocks import Deadlock, DeadlockStack
+from dl_trace import read_trace, OP_ADD, OP_REMOVE, OP_SET_DESC, OP_LOADED, OP_ADD_FULL, OP_DROP
+
+# Replays a trace recorded by DeadlockStack (batch_search.py --trace)
+# on a fresh DeadlockStack, without any level or search.
+# Full deadlocks loaded from the deadlock file at the start of the session
+# are replaced by placeholders, they only appear as descendants
+# (so they are not in the deadlock set, and cannot be dropped from it).
+
+op_names = {
+    OP_ADD : "add", OP_REMOVE : "remove", OP_SET_DESC : "set_descendants",
+    OP_LOADED : "loaded", OP_ADD_FULL : "add_full_blocks", OP_DROP : "drop",
+}
+
+def replay(trace_fname, limit = None, check = False):
+    dl_stack = DeadlockStack()
+    dl_stack.debug_fname = None
+    deadlocks = dict()
+    placeholders = dict() # also the deadlocks of add_full_blocks, by their ref
+    def get_deadlock(ref):
+        if ref >= 0: return deadlocks[ref]
+        deadlock = placeholders.get(ref)
+        if deadlock is None:
+            deadlock = Deadlock((), (), None)
+            deadlock.full_index = -ref-1
+            deadlock.descendants = dict()
+            placeholders[ref] = deadlock
+        return deadlock
+
+    op_count = { op : 0 for op in op_names }
+    op_time = { op : 0. for op in op_names }
+    for i, record in enumerate(read_trace(trace_fname)):
+        if limit is not None and i >= limit: break
+        op = record[0]
+        if op == OP_ADD:
+            _, dl_id, stack_index, boxes, not_boxes, sk_component = record
+            deadlock = Deadlock(boxes, not_boxes, sk_component)
+            start = time.perf_counter()
+            dl_stack.add(deadlock, stack_index)
+            op_time[op] += time.perf_counter() - start
+            deadlocks[dl_id] = deadlock
+        elif op == OP_REMOVE:
+            _, ids = record
+            to_remove = [get_deadlock(dl_id) for dl_id in ids]
+            start = time.perf_counter()
+            dl_stack.remove(to_remove)
+            op_time[op] += time.perf_counter() - start
+        elif op == OP_SET_DESC:
+            _, dl_id, actions, descendant_ids = record
+            descendants = [get_deadlock(desc_id) for desc_id in descendant_ids]
+            start = time.perf_counter()
+            dl_stack.set_descendants(get_deadlock(dl_id), actions, descendants)
+            op_time[op] += time.perf_counter() - start
+        elif op == OP_LOADED:
+            _, count = record
+            dl_stack._last_full_index = count-1
+        elif op == OP_ADD_FULL:
+            _, block_data = record
+            block = []
+            for full_index, boxes, not_boxes, sk_component, _, _ in block_data:
+                deadlock = Deadlock(boxes, not_boxes, sk_component)
+                placeholders[-(full_index+1)] = deadlock
+                block.append(deadlock)
+            for deadlock, (_, _, _, _, actions, descendant_ids) in zip(block, block_data):
+                deadlock.descendants = {
+                    action : get_deadlock(desc_id)
+                    for action, desc_id in zip(actions, descendant_ids)
+                }
+            start = time.perf_counter()
+            dl_stack.add_full_blocks([block])
+            op_time[op] += time.perf_counter() - start
+            assert [dl.full_index for dl in block] == [data[0] for data in block_data]
+        elif op == OP_DROP:
+            _, ids = record
+            start = time.perf_counter()
+            for deadlock in map(get_deadlock, ids):
+                if deadlock in dl_stack.dl_set: dl_stack.dl_set.remove(deadlock)
+            op_time[op] += time.perf_counter() - start
+        op_count[op] += 1
+        if check: dl_stack.check_correct()
+
+    return dl_stack, op_count, op_time
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='replay_trace',
+                                     description='Replay a DeadlockStack trace',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('trace', type=str, help='trace file (var_dir/deadlocks.trace)')
+    parser.add_argument('--limit', type=int, default = None,
+                        help='replay only the first operations (for bisecting)')
+    parser.add_argument('--check', action = 'store_true',
+                        help='check the stack indices after every operation')
+    args = parser.parse_args()
+
+    dl_stack, op_count, op_time = replay(args.trace, limit = args.limit, check = args.check)
+    for op, name in op_names.items():
+        print("{:16} {:8} ops {:9.3f}s".format(name, op_count[op], op_time[op]))
+    print("{} full deadlocks, {} deadlocks in the set".format(
+        dl_stack._last_full_index+1, len(dl_stack.dl_set)))
@@ -2,7 +2,8 @@ import numpy as np
 
 from directions import *
 from helpers import positions_true
-from component2d import get_component, component_split, find_path
+from component2d import get_component, component_split, find_path, update_component
+from zobrist import get_zobrist_keys
 
 class SokoState:
     __slots__ = [
@@ -19,10 +20,11 @@ class SokoState:
         "storekeeper", # single storekeeper position
         "storekeeper_goal", # for dual sokoban
         "multi_component", # if True, self.storekeepers can consist of multiple components
+        "box_hash", # zobrist hash of sub_boxes, computed on demand
     ]
     def __init__(self, available, sub_boxes, sup_boxes, storages,
                  storekeeper, storekeepers = None, sub_full = None,
-                 storekeeper_goal = None, multi_component = None):
+                 storekeeper_goal = None, multi_component = None, box_hash = None):
         h,w = available.shape
         self.height = h-2
         self.width = w-2
@@ -45,6 +47,22 @@ class SokoState:
 
         if sub_full is not None: self.sub_full = sub_full
         else: self.sub_full = (np.sum(sub_boxes) == np.sum(storages))
+        self.box_hash = box_hash
+
+    # hash of sub_boxes and the storekeeper component (sup_boxes are ignored)
+    def zobrist(self):
+        keys = get_zobrist_keys(self.available.shape)
+        if self.box_hash is None: self.box_hash = keys.boxes_hash(self.sub_boxes)
+        return self.box_hash ^ keys.storekeeper_key(self.storekeepers)
+
+    # box_hash after the move, without making the new state
+    def moved_box_hash(self, y, x, d):
+        keys = get_zobrist_keys(self.available.shape)
+        if self.box_hash is None: self.box_hash = keys.boxes_hash(self.sub_boxes)
+        box = (y+1,x+1)
+        res = self.box_hash ^ keys.box_key(dir_shift(d, box))
+        if self.sub_boxes[box]: res ^= keys.box_key(box)
+        return res
 
     def clone(self):
         return SokoState(
@@ -57,6 +75,7 @@ class SokoState:
             sub_full = self.sub_full,
             storekeeper_goal = self.storekeeper_goal,
             multi_component = self.multi_component,
+            box_hash = self.box_hash,
         )
 
     def action_mask(self, fw_mode = True): # size: [self.width, self.height, 4]
@@ -121,8 +140,24 @@ class SokoState:
         sup_boxes_n = np.array(self.sup_boxes)
         sup_boxes_n[box] = False
         sup_boxes_n[box2] = True
+        # pushing a box only in sup_boxes adds a box to sub_boxes
+        if self.sub_boxes[box]: sub_full_n = self.sub_full
+        else: sub_full_n = None
+        if self.box_hash is None: box_hash_n = None
+        else: box_hash_n = self.moved_box_hash(y, x, d)
+        if self.multi_component: storekeepers_n = None
+        else:
+            storekeepers_n = update_component(
+                self.storekeepers, self.available & ~sub_boxes_n, box, box2,
+            )
+        if storekeepers_n is None: # recompute from scratch
+            return SokoState(self.available, sub_boxes_n, sup_boxes_n, self.storages,
+                             storekeeper = storekeeper_n, sub_full = sub_full_n,
+                             storekeeper_goal = self.storekeeper_goal, box_hash = box_hash_n)
         return SokoState(self.available, sub_boxes_n, sup_boxes_n, self.storages,
-                         storekeeper = storekeeper_n, storekeeper_goal = self.storekeeper_goal)
+                         storekeeper = storekeeper_n, storekeepers = storekeepers_n,
+                         sub_full = sub_full_n, storekeeper_goal = self.storekeeper_goal,
+                         multi_component = False, box_hash = box_hash_n)
 
     def action_to_basic_moves(self, action, fw_mode = True):
         assert self.action_mask(fw_mode = fw_mode)[action]
@@ -169,8 +204,110 @@ class SokoState:
             sub_full = self.sub_full,
             storekeeper_goal = self.storekeeper_goal,
             multi_component = self.multi_component,
+            box_hash = self.box_hash,
         )
 
+# N states of one level stacked into arrays of shape [N, height+2, width+2],
+# available and storages can be shared as [height+2, width+2].
+# The methods correspond to SokoState, vectorized over the states.
+class SokoStateBatch:
+    __slots__ = [
+        "available", "sub_boxes", "sup_boxes", "storages", "storekeepers",
+        "sub_full", # shape [N]
+        "storekeeper_goal", # common for all the states
+    ]
+    def __init__(self, available, sub_boxes, sup_boxes, storages, storekeepers,
+                 sub_full = None, storekeeper_goal = None):
+        self.available = available
+        self.sub_boxes = sub_boxes
+        self.sup_boxes = sup_boxes
+        self.storages = storages
+        self.storekeepers = storekeepers
+        if sub_full is None:
+            sub_full = (np.sum(sub_boxes, axis = (-2,-1)) == np.sum(storages, axis = (-2,-1)))
+        self.sub_full = np.broadcast_to(sub_full, (len(sub_boxes),))
+        self.storekeeper_goal = storekeeper_goal
+
+    @staticmethod
+    def from_states(states):
+        states = list(states)
+        first = states[0]
+        def stack(attr):
+            arrs = [getattr(state, attr) for state in states]
+            if all(arr is arrs[0] for arr in arrs): return arrs[0]
+            return np.stack(arrs)
+        return SokoStateBatch(
+            stack("available"),
+            np.stack([state.sub_boxes for state in states]),
+            np.stack([state.sup_boxes for state in states]),
+            stack("storages"),
+            np.stack([state.storekeepers for state in states]),
+            sub_full = np.array([state.sub_full for state in states]),
+            storekeeper_goal = first.storekeeper_goal,
+        )
+
+    def __len__(self): return len(self.sub_boxes)
+    def __getitem__(self, i):
+        def get(arr):
+            if arr.ndim == 3: return arr[i]
+            else: return arr
+        storekeepers = self.storekeepers[i]
+        return SokoState(
+            get(self.available), self.sub_boxes[i], self.sup_boxes[i], get(self.storages),
+            storekeeper = positions_true(storekeepers)[0], storekeepers = storekeepers,
+            sub_full = bool(self.sub_full[i]), storekeeper_goal = self.storekeeper_goal,
+        )
+
+    def action_mask(self, fw_mode = True): # size: [N, height, width, 4]
+        not_full = ~self.sub_full[:,None,None]
+        free = self.available & ~self.sub_boxes
+        def action_mask_in_dir(d):
+            has_box = self.sub_boxes | (
+                not_full & self.sup_boxes & dir_shift_array(op_dir(d), ~self.sup_boxes)
+            )
+            if fw_mode:
+                sk_reachable = dir_shift_array(d, self.storekeepers)
+                dest_available = dir_shift_array(op_dir(d), free)
+            else:
+                sk_reachable = dir_shift_array(op_dir(d), self.storekeepers)
+                dest_available = dir_shift_array(op_dir(d), dir_shift_array(op_dir(d), free))
+            return sk_reachable & dest_available & has_box
+
+        return np.stack(
+            [
+                action_mask_in_dir(d)
+                for d in directions
+            ],
+            axis = -1,
+        )[:,1:-1,1:-1]
+
+    def export(self): # size: [N, height, width, 5]
+        shape = self.sub_boxes.shape
+        return np.stack(
+            [
+                np.broadcast_to(self.available, shape), self.sub_boxes, self.sup_boxes,
+                np.broadcast_to(self.storages, shape), self.storekeepers,
+            ],
+            axis = -1,
+        )[:,1:-1,1:-1]
+
+    def is_solved(self, other_goal = None):
+        if other_goal is None:
+            storekeeper_goal = self.storekeeper_goal
+            storages = self.storages
+        else:
+            storages, storekeeper_goal = other_goal
+
+        res = ~(self.sub_boxes & ~storages).any(axis = (-2,-1)) \
+            & ~(storages & ~self.sup_boxes).any(axis = (-2,-1))
+        if storekeeper_goal is not None:
+            y,x = storekeeper_goal
+            res &= self.storekeepers[:,y,x]
+        return res
+    def score(self):
+        return (np.sum(self.sub_boxes & self.storages, axis = (-2,-1))
+                + np.sum(self.sup_boxes & self.storages, axis = (-2,-1)))/2
+
 def level_to_state(level):
     size_bord = level.height+2, level.width+2
     available = np.zeros(size_bord, dtype = bool)
@@ -9,17 +9,17 @@ import numpy as np
 import os
 import random
 
-from move_stack import MoveStack
-from data_loader import load_xsb_levels
+from data_loader import LevelSet
+from level_session import LevelSession, get_level_basename
 from soko_state import *
 from directions import *
 from helpers import *
 from component2d import *
-from heuristic import heurictic_to_storage
 
 class SokoGUI(Gtk.Window):
 
-    def __init__(self, levelset_fname, level_i, var_dir = 'var', win_size = (800, 600)):
+    def __init__(self, levelset_fname, level_i, var_dir = 'var', win_size = (800, 600),
+                 minimize = 0):
 
         super(SokoGUI, self).__init__()
 
@@ -29,13 +29,13 @@ class SokoGUI(Gtk.Window):
         self.timer_id = None
 
         self.levelset_fname = levelset_fname
-        self.levelset_basename, _ = os.path.splitext(os.path.basename(levelset_fname))
-        self.levels = load_xsb_levels(levelset_fname)
+        self.minimize = minimize
+        self.levels = LevelSet(levelset_fname)
         print("{} levels loaded".format(len(self.levels)))
         self.level_i = np.clip(level_i, 1, len(self.levels))
         self.var_dir = var_dir
 
-        self.fw_mode = True
+        self.session = None
         self.make_move_stacks()
 
         self.darea = Gtk.DrawingArea()
@@ -61,27 +61,17 @@ class SokoGUI(Gtk.Window):
         self.connect("delete-event", Gtk.main_quit)
         self.show_all()
 
-    def make_move_stacks(self):
+    def make_move_stacks(self, fw_mode = True):
 
         print("Level {}".format(self.level_i))
-        state = level_to_state(self.levels[self.level_i-1])
-        dual_state = level_to_dual_state(self.levels[self.level_i-1])
-        level_basename = self.levelset_basename + '_l' + str(self.level_i)
-        level_var_dir = os.path.join(self.var_dir, level_basename)
-        os.makedirs(level_var_dir, exist_ok = True)
-        dl_fname = os.path.join(level_var_dir, 'deadlocks')
-        dual_dl_fname = os.path.join(level_var_dir, 'dual_deadlocks')
-        print('Preparing forward stack')
-        move_stack = MoveStack(state, dl_fname = dl_fname)
-        print('Preparing backward stack')
-        dual_move_stack = MoveStack(dual_state, dl_fname = dual_dl_fname, fw_mode = False)
-        self.move_stacks = [
-            dual_move_stack, move_stack
-        ]
-        self.was_solved = False
+        if self.session is not None: self.session.close()
+        self.session = LevelSession(
+            self.levels[self.level_i-1],
+            get_level_basename(self.levelset_fname, self.level_i),
+            var_dir = self.var_dir, fw_mode = fw_mode,
+            minimize = self.minimize,
+        )
         self.update_box_jumps()
-        self.level_var_dir = level_var_dir
-        self.level_basename = level_basename
 
     def update_box_jumps(self):
         self.box_jumps = dict()
@@ -95,7 +85,8 @@ class SokoGUI(Gtk.Window):
         else:
             state = self.state
             box_jumps = find_box_jumps_from_sk(
-                state.available, state.sub_boxes, src1, state.storekeepers, self.fw_mode
+                state.available, state.sub_boxes, src1, state.storekeepers, self.fw_mode,
+                jump_map = self.move_stack.get_jump_map(),
             )
             if box_jumps is not None:
                 box_jumps = box_jumps[1][1:-1,1:-1]
@@ -146,101 +137,29 @@ class SokoGUI(Gtk.Window):
         self.update_box_jumps()
 
     @property
-    def move_stack(self): return self.move_stacks[self.fw_mode]
+    def fw_mode(self): return self.session.fw_mode
+    @fw_mode.setter
+    def fw_mode(self, fw_mode): self.session.fw_mode = fw_mode
     @property
-    def dual_move_stack(self): return self.move_stacks[not self.fw_mode]
+    def move_stacks(self): return self.session.move_stacks
     @property
-    def state(self): return self.move_stack.state
+    def move_stack(self): return self.session.move_stack
     @property
-    def base_state(self): return self.move_stack.base_state
+    def dual_move_stack(self): return self.session.dual_move_stack
     @property
-    def dual_state(self): return self.dual_move_stack.base_state
+    def state(self): return self.session.state
     @property
-    def storekeeper_goal(self):
-        if self.fw_mode and self.dual_move_stack.is_on_start():
-            return None
-        sk = self.dual_move_stack.state.storekeeper
-        if self.dual_state.storekeepers[sk]: return sk
-        else: return self.dual_state.storekeeper
-
-    def heuristic(self, state, fw_mode):
-        storages = self.dual_state.sub_boxes
-        return heurictic_to_storage(state, fw_mode, storages = storages)
-    def is_solved(self):
-        is_solved = self.state.is_solved(
-            other_goal = (self.dual_state.sub_boxes, self.storekeeper_goal)
-        )
-        if is_solved and not self.move_stack.was_generalized() and not self.was_solved:
-            self.was_solved = True
-            bw_move_stack, fw_move_stack = self.move_stacks
-            fw_actions = fw_move_stack.get_past_actions()
-            bw_actions = bw_move_stack.get_past_actions()
-            fw_states = fw_move_stack.get_past_states()
-            bw_states = bw_move_stack.get_past_states()
-            fw_moves = []
-            for state, action in zip(fw_states, fw_actions):
-                fw_moves.extend(state.action_to_basic_moves(action, fw_mode = True))
-            if bw_actions:
-                bw_moves = [bw_actions[0][-1]]
-                for state, action in zip(bw_states[1:], bw_actions[1:]):
-                    bw_moves.extend(state.action_to_basic_moves(action, fw_mode = False))
-                fw_state = fw_states[-1]
-                bw_state = bw_states[-1]
-                fw_moves.extend(
-                    find_path(
-                        fw_state.available & ~fw_state.sub_boxes,
-                        fw_state.storekeeper,
-                        bw_state.storekeeper,
-                    )
-                )
-                bw_actions.reverse()
-                bw_moves.reverse()
-                fw_actions.extend(dual_action(a) for a in bw_actions)
-                fw_moves.extend(op_dir(d) for d in bw_moves)
-
-            sol_fname = "solution_{}_{}".format(len(fw_moves), len(fw_actions))
-            move_fname = os.path.join(self.level_var_dir, sol_fname+".mov")
-            action_fname = os.path.join(self.level_var_dir, sol_fname+".act")
-            with open(move_fname, 'w') as f:
-                f.write(''.join(
-                    dir_to_c(d) for d in fw_moves
-                )+'\n')
-            with open(action_fname, 'w') as f:
-                for y,x,d in fw_actions:
-                    print(y, x, dir_to_c(d), file = f)
-            print("Saved solution: {} moves, {} pushes".format(
-                len(fw_moves), len(fw_actions)))
-
-        return is_solved
-    def search_step(self, min_move = 0):
-        if self.is_solved(): return False
-        if self.move_stack.redo():
-            if self.move_stack.is_locked(): self.move_stack.undo()
-            else: return True
-
-        if self.move_stack.search_step(heuristic = self.heuristic, min_move = min_move):
-            return True
-        if self.move_stack.is_solved(): self.dual_move_stack.reset()
-        return False
-    def auto_move(self):
-        if not self.state.sub_full:
-            self.move_stack.change_sub_boxes(self.base_state.sub_boxes)
+    def base_state(self): return self.session.base_state
+    @property
+    def dual_state(self): return self.session.dual_state
+    @property
+    def storekeeper_goal(self): return self.session.storekeeper_goal
+    @property
+    def level_basename(self): return self.session.level_basename
 
-        if self.is_solved():
-            if self.dual_move_stack.is_on_start(): return False
-            action = dual_action(self.dual_move_stack.last_action)
-            if not self.move_stack.is_on_end() and action == self.move_stack.next_action:
-                self.move_stack.redo()
-            else: self.move_stack.apply_action(action)
-            self.dual_move_stack.undo()
-            return True
-        elif self.move_stack.redo(): return True
-        else:
-            action = self.move_stack.choose_action(
-                heuristic = self.heuristic)
-            if action is None: return False
-            self.move_stack.apply_action(action)
-            return True
+    def is_solved(self): return self.session.is_solved()
+    def search_step(self, min_move = 0): return self.session.search_step(min_move)
+    def auto_move(self): return self.session.auto_move()
     def basic_move(self, d):
         sk2 = dir_shift(d, self.state.storekeeper)
         if self.state.storekeepers[sk2]:
@@ -295,13 +214,13 @@ class SokoGUI(Gtk.Window):
             if self.level_i > 1:
                 self.cancel()
                 self.level_i -= 1
-                self.make_move_stacks()
+                self.make_move_stacks(self.fw_mode)
                 self.darea.queue_draw()
         elif keyval_name == "Page_Down":
             if self.level_i < len(self.levels):
                 self.cancel()
                 self.level_i += 1
-                self.make_move_stacks()
+                self.make_move_stacks(self.fw_mode)
                 self.darea.queue_draw()
         elif keyval_name in ('Return', 'r', 'R'):
             if shift_pressed:
@@ -753,7 +672,10 @@ if __name__ == "__main__":
     parser.add_argument('levelset', type=str, nargs='?',
                         default = './data/Large Test Suite/XSokoban_90.xsb',
                         help='file to load the level set (in xsb format)')
+    parser.add_argument('--minimize', type=int, default = 0,
+                        help='processes minimizing new full deadlocks in the background (see minimizer.py)')
     args = parser.parse_args()
 
-    win = SokoGUI(args.levelset, args.level)
+    win = SokoGUI(args.levelset, args.level, minimize = args.minimize)
     Gtk.main()
+    win.session.close()
@@ -0,0 +1,248 @@
+#!/usr/bin/python3
+
+import argparse
+import contextlib
+import heapq
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+
+from data_loader import LevelSet
+from soko_state import level_to_state, level_to_dual_state
+from deadlocks import DeadlockSet, deadlocks_from_file
+from hungarian import HungarianHeuristic, INF
+from static_tables import load_static_tables
+from level_session import get_level_basename, stitch_solution, save_solution
+from helpers import positions_true
+
+# Unattended solver over box moves (pushes, or pulls in the dual mode),
+# best-first A* or IDA*, both with the matching lower bound of hungarian.py,
+# so the solutions are optimal in the number of box moves.
+# Moves into a deadlock recorded in the 'var' directory are pruned
+# (the deadlock files are only read), positions are identified
+# by their zobrist hash. Solutions are saved as .mov / .act like in the GUI.
+
+class SearchLimit(Exception):
+    pass
+
+# meet(key) is called on every expanded position of astar(), if it returns a key,
+# the search stops with the path to that (already expanded) position, see bidir.py
+class Solver:
+    def __init__(self, start_state, dl_set, heuristic, fw_mode = True,
+                 max_nodes = None, max_time = None, meet = None):
+        self.start_state = start_state
+        self.meet = meet
+        self.parents = None # key -> (parent key, action), None for the start
+        self.dl_set = dl_set
+        self.heuristic = heuristic
+        self.fw_mode = fw_mode
+        self.max_nodes = max_nodes
+        self.max_time = max_time
+        self.stats = dict(expanded = 0, generated = 0, deadlocks = 0, transpositions = 0)
+        self.start_time = None
+
+    def _check_limits(self):
+        if self.max_nodes is not None and self.stats['expanded'] >= self.max_nodes:
+            raise SearchLimit()
+        if self.max_time is not None and time.time() - self.start_time >= self.max_time:
+            raise SearchLimit()
+
+    # [(action, lower bound after it)] of the moves not leading to a recorded deadlock
+    def children(self, state):
+        self._check_limits()
+        self.stats['expanded'] += 1
+        actions = positions_true(state.action_mask(fw_mode = self.fw_mode))
+        locks = self.dl_set.find_for_actions(state, actions, fw_mode = self.fw_mode)
+        bounds = self.heuristic.move_bounds(state, actions, self.fw_mode)
+        res = []
+        for action, lock, bound in zip(actions, locks, bounds):
+            if lock is not None: self.stats['deadlocks'] += 1
+            elif bound < INF: res.append((action, bound))
+        self.stats['generated'] += len(res)
+        return res
+
+    def astar(self):
+        start = self.start_state
+        h = self.heuristic.lower_bound(start, self.fw_mode)
+        if h >= INF: return None
+        counter = itertools.count()
+        best_g = { start.zobrist() : 0 }
+        self.parents = parents = { start.zobrist() : None }
+        heap = [(h, h, 0, next(counter), start)]
+        while heap:
+            _, _, g, _, state = heapq.heappop(heap)
+            key = state.zobrist()
+            if best_g[key] < g: continue
+            if state.is_solved(): return self.path_to(key)
+            if self.meet is not None:
+                meet_key = self.meet(key)
+                if meet_key is not None: return self.path_to(meet_key)
+            for action, h in self.children(state):
+                child = state.move(*action, fw_mode = self.fw_mode)
+                child_key = child.zobrist()
+                if best_g.get(child_key, INF) <= g+1:
+                    self.stats['transpositions'] += 1
+                    continue
+                best_g[child_key] = g+1
+                parents[child_key] = (key, action)
+                heapq.heappush(heap, (g+1+h, h, g+1, next(counter), child))
+        return None
+
+    def path_to(self, key):
+        actions = []
+        while self.parents[key] is not None:
+            key, action = self.parents[key]
+            actions.append(action)
+        actions.reverse()
+        return actions
+
+    def idastar(self):
+        start = self.start_state
+        threshold = self.heuristic.lower_bound(start, self.fw_mode)
+        if threshold >= INF: return None
+        if start.is_solved(): return []
+        while True:
+            next_threshold = INF
+            best_g = { start.zobrist() : 0 }
+            actions = []
+            stack = [(start, 0, iter(sorted(self.children(start), key = lambda c: c[1])))]
+            while stack:
+                state, g, children = stack[-1]
+                child = next(children, None)
+                if child is None:
+                    stack.pop()
+                    if stack: actions.pop()
+                    continue
+                action, h = child
+                if g+1+h > threshold:
+                    next_threshold = min(next_threshold, g+1+h)
+                    continue
+                child = state.move(*action, fw_mode = self.fw_mode)
+                child_key = child.zobrist()
+                if best_g.get(child_key, INF) <= g+1:
+                    self.stats['transpositions'] += 1
+                    continue
+                best_g[child_key] = g+1
+                actions.append(action)
+                if child.is_solved(): return actions
+                stack.append((child, g+1, iter(sorted(self.children(child), key = lambda c: c[1]))))
+            if next_threshold >= INF: return None
+            threshold = next_threshold
+
+    # returns the list of actions, None if there is no solution,
+    # raises SearchLimit if max_nodes or max_time is exceeded
+    def solve(self, algorithm = "astar"):
+        self.start_time = time.time()
+        if algorithm == "astar": return self.astar()
+        elif algorithm == "idastar": return self.idastar()
+        else: raise Exception("unknown algorithm {}".format(algorithm))
+
+# the file may be appended by a running search, so a torn tail is only skipped
+# (load_deadlocks would truncate it and write the .bin sidecar)
+def load_deadlock_set(fname, base_state):
+    dl_set = DeadlockSet()
+    if os.path.exists(fname):
+        blocks, _ = deadlocks_from_file(fname, base_state, torn_tail = True)
+        for block in blocks:
+            for deadlock in block: dl_set.add(deadlock)
+    return dl_set
+
+def solve_level(level, level_basename, var_dir = 'var', fw_mode = True, algorithm = "astar",
+                max_nodes = None, max_time = None):
+    state = level_to_state(level)
+    dual_state = level_to_dual_state(level)
+    level_var_dir = os.path.join(var_dir, level_basename)
+    os.makedirs(level_var_dir, exist_ok = True)
+    if fw_mode:
+        start_state = state
+        dl_fname = os.path.join(level_var_dir, 'deadlocks')
+    else:
+        start_state = dual_state
+        dl_fname = os.path.join(level_var_dir, 'dual_deadlocks')
+    dl_set = load_deadlock_set(dl_fname, start_state)
+    heuristic = HungarianHeuristic(load_static_tables(level_var_dir, state, dual_state))
+
+    solver = Solver(start_state, dl_set, heuristic, fw_mode = fw_mode,
+                    max_nodes = max_nodes, max_time = max_time)
+    res = dict(loaded_deadlocks = len(dl_set))
+    if dl_set.find_by_state(start_state) is not None: actions = None
+    else:
+        try: actions = solver.solve(algorithm)
+        except SearchLimit: actions = False
+    res.update(solver.stats)
+    res['time'] = time.time() - solver.start_time if solver.start_time is not None else 0.
+
+    if actions is None: res['status'] = 'unsolvable'
+    elif actions is False: res['status'] = 'budget'
+    else:
+        states = [start_state]
+        for action in actions:
+            states.append(states[-1].move(*action, fw_mode = fw_mode))
+        if fw_mode: fw_moves, fw_actions = stitch_solution(states, actions, [], [])
+        else: fw_moves, fw_actions = stitch_solution([state], [], states, actions)
+        save_solution(level_var_dir, fw_moves, fw_actions)
+        res['status'] = 'solved'
+        res['pushes'] = len(fw_actions)
+        res['moves'] = len(fw_moves)
+    return res
+
+_levels = None
+_args = None
+def _init_worker(args):
+    global _levels, _args
+    _args = args
+    _levels = LevelSet(args.levelset)
+
+def _solve_level_worker(level_i):
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            res = solve_level(
+                _levels[level_i-1], get_level_basename(_args.levelset, level_i),
+                var_dir = _args.var_dir, fw_mode = not _args.dual,
+                algorithm = _args.algorithm,
+                max_nodes = _args.max_nodes, max_time = _args.max_time,
+            )
+    res['level'] = level_i
+    return res
+
+if __name__ == "__main__":
+    from batch_search import parse_level_list
+
+    parser = argparse.ArgumentParser(prog='solver',
+                                     description='Automatic A* / IDA* solver using the recorded deadlocks',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('levelset', type=str, help='file to load the level set (in xsb format)')
+    parser.add_argument('--levels', type=str, default = None,
+                        help='comma separated level numbers or ranges (1-based), default all')
+    parser.add_argument('--var_dir', type=str, default = 'var')
+    parser.add_argument('--processes', type=int, default = os.cpu_count())
+    parser.add_argument('--algorithm', type=str, default = "astar", choices = ["astar", "idastar"])
+    parser.add_argument('--dual', action = 'store_true', help='search by pulls from the goal')
+    parser.add_argument('--max_nodes', type=int, default = 100000, help='expanded positions per level')
+    parser.add_argument('--max_time', type=float, default = 60., help='seconds per level')
+    args = parser.parse_args()
+
+    num_levels = len(LevelSet(args.levelset))
+    level_list = parse_level_list(args.levels, num_levels)
+    print("Solving {} levels, {} processes".format(len(level_list), args.processes))
+
+    status_count = dict()
+    with multiprocessing.Pool(args.processes, initializer = _init_worker,
+                              initargs = (args,)) as pool:
+        for res in pool.imap_unordered(_solve_level_worker, level_list):
+            status_count[res['status']] = status_count.get(res['status'], 0) + 1
+            if res['status'] == 'solved':
+                solution = ", {} pushes, {} moves".format(res['pushes'], res['moves'])
+            else: solution = ""
+            print("Level {}: {}{}, {} expanded, {} generated, {} deadlock cuts, {:.1f}s".format(
+                res['level'], res['status'], solution, res['expanded'], res['generated'],
+                res['deadlocks'], res['time'],
+            ))
+            sys.stdout.flush()
+
+    print(", ".join(
+        "{} {}".format(n, status)
+        for status, n in sorted(status_count.items())
+    ))
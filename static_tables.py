@@ -0,0 +1,122 @@
+import numpy as np
+import os
+import hashlib
+
+from directions import *
+from helpers import positions_true
+
+# Tables depending only on the walls and the targets of a level,
+# computed on the empty board (other boxes and the storekeeper position are ignored).
+# For every target, the number of box moves (pushes in the forward mode,
+# pulls in the backward mode) needed to bring a box from a square to the target.
+# Squares from which no target is reachable are dead in the given mode.
+# The tables are indexed by fw_mode as the move stacks of LevelSession.
+
+UNREACHABLE = np.iinfo(np.int32).max
+_tables_version = 1
+
+def box_distances(available, target, fw_mode = True):
+    dist = np.full(available.shape, UNREACHABLE, dtype = np.int32)
+    reached = np.zeros_like(available)
+    reached[target] = True
+    dist[target] = 0
+    frontier = reached
+    # the box can be moved from square p in direction d if
+    #   fw_mode: p-d (storekeeper) and p+d are available
+    #   otherwise: p+d and p+2d (storekeeper) are available
+    if fw_mode: sk_available = [dir_shift_array(d, available) for d in directions]
+    else: sk_available = [
+        dir_shift_array(op_dir(d), dir_shift_array(op_dir(d), available))
+        for d in directions
+    ]
+    i = 0
+    while frontier.any():
+        i += 1
+        new = np.zeros_like(frontier)
+        for d in directions:
+            new |= dir_shift_array(op_dir(d), frontier) & sk_available[d]
+        new &= available & ~reached
+        dist[new] = i
+        reached |= new
+        frontier = new
+    return dist
+
+class StaticTables:
+    def __init__(self, available, targets, target_dists):
+        self.available = available
+        self.targets = targets # [bw_targets, fw_targets]
+        self.target_dists = target_dists # [bw, fw], shape [num_targets, height, width]
+        self.dists = [np.min(dists, axis = 0) for dists in target_dists]
+        self._toward = [None, None]
+        self._to_dead = [None, None]
+
+    def has_targets(self, storages, fw_mode = True):
+        return np.array_equal(storages, self.targets[fw_mode])
+
+    def dead_squares(self, fw_mode = True):
+        return self.available & (self.dists[fw_mode] == UNREACHABLE)
+
+    # [height, width, 4] masks of box moves (y,x,d) on the padded grid
+    def toward_target(self, fw_mode = True):
+        if self._toward[fw_mode] is None:
+            dist = self.dists[fw_mode]
+            self._toward[fw_mode] = np.stack([
+                dir_shift_array(op_dir(d), dist) < dist
+                for d in directions
+            ], axis = -1)
+        return np.array(self._toward[fw_mode])
+    def to_dead_square(self, fw_mode = True):
+        if self._to_dead[fw_mode] is None:
+            dead = self.dead_squares(fw_mode)
+            self._to_dead[fw_mode] = np.stack([
+                dir_shift_array(op_dir(d), dead)
+                for d in directions
+            ], axis = -1)
+        return self._to_dead[fw_mode]
+
+def level_fingerprint(state, dual_state):
+    h = hashlib.sha1()
+    h.update(str((_tables_version, state.available.shape)).encode())
+    for arr in (state.available, state.storages, dual_state.storages):
+        h.update(np.packbits(arr).tobytes())
+    return h.hexdigest()
+
+def compute_static_tables(state, dual_state):
+    available = state.available
+    targets = [dual_state.storages, state.storages]
+    target_dists = [
+        np.array([
+            box_distances(available, target, fw_mode)
+            for target in positions_true(targets[fw_mode])
+        ]).reshape(-1, *available.shape)
+        for fw_mode in (False, True)
+    ]
+    return StaticTables(available, targets, target_dists)
+
+# loads the tables from level_var_dir/static_tables.npz,
+# recomputes them if they are missing or the level changed
+def load_static_tables(level_var_dir, state, dual_state):
+    fname = os.path.join(level_var_dir, "static_tables.npz")
+    fingerprint = level_fingerprint(state, dual_state)
+    if os.path.exists(fname):
+        try:
+            with np.load(fname) as data:
+                if str(data["fingerprint"]) == fingerprint:
+                    return StaticTables(
+                        state.available, [dual_state.storages, state.storages],
+                        [data["bw_dists"], data["fw_dists"]],
+                    )
+        except (OSError, ValueError, KeyError):
+            pass
+
+    tables = compute_static_tables(state, dual_state)
+    tmp_fname = fname+".tmp"
+    try:
+        with open(tmp_fname, 'wb') as f:
+            np.savez(f, fingerprint = fingerprint,
+                     bw_dists = tables.target_dists[False],
+                     fw_dists = tables.target_dists[True])
+        os.replace(tmp_fname, fname)
+    except OSError:
+        pass
+    return tables
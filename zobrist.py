@@ -0,0 +1,33 @@
+import numpy as np
+
+# Zobrist hashing of sokoban positions: xor of random keys of the boxes
+# together with a key of the normalized storekeeper position
+# (the first square of the storekeeper component).
+# The keys depend only on the board shape, so the hashes agree between processes.
+
+class ZobristKeys:
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.width = self.shape[1]
+        rng = np.random.default_rng([0x50c0, *self.shape])
+        self.box_keys = rng.integers(0, 2**64, size = self.shape, dtype = np.uint64)
+        self.sk_keys = rng.integers(0, 2**64, size = self.shape, dtype = np.uint64)
+        self._box_keys_l = self.box_keys.reshape(-1).tolist()
+        self._sk_keys_l = self.sk_keys.reshape(-1).tolist()
+
+    def box_key(self, pos):
+        y,x = pos
+        return self._box_keys_l[y*self.width+x]
+    def boxes_hash(self, boxes):
+        return int(np.bitwise_xor.reduce(self.box_keys[boxes]))
+    def storekeeper_key(self, storekeepers):
+        return self._sk_keys_l[int(np.argmax(storekeepers))]
+
+_keys = dict()
+def get_zobrist_keys(shape):
+    shape = tuple(shape)
+    keys = _keys.get(shape, None)
+    if keys is None:
+        keys = ZobristKeys(shape)
+        _keys[shape] = keys
+    return keys